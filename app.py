@@ -1,6 +1,6 @@
 from flask import Flask, jsonify
 from flask_migrate import Migrate
-from config import configure_db, configure_jwt, db
+from config import configure_db, configure_jwt, db, RECOGNITION_MAX_UPLOAD_BYTES
 from routes.user_routes import user_bp
 from routes.auth_routes import auth_bp
 from routes.recognize_routes import recognize_bp
@@ -8,6 +8,7 @@ from routes.attendance_routes import attendance_bp
 from routes.stats_routes import stats_bp
 from routes.organization_routes import organization_bp
 from flask_cors import CORS
+from commands import register_commands
 
 
 def create_app():
@@ -17,6 +18,8 @@ def create_app():
     configure_db(app)
     # configure_cors(app)
     configure_jwt(app)
+    # Image uploads are the largest request bodies; anything bigger is refused before it is read
+    app.config['MAX_CONTENT_LENGTH'] = RECOGNITION_MAX_UPLOAD_BYTES
 
     # Register routes
     app.register_blueprint(user_bp, url_prefix='/users')
@@ -26,6 +29,9 @@ def create_app():
     app.register_blueprint(stats_bp, url_prefix='/stats')
     app.register_blueprint(organization_bp, url_prefix='/organizations')
 
+    # Register CLI commands (flask backfill-faces)
+    register_commands(app)
+
     return app
 
 # Initialize the app
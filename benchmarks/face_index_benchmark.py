@@ -0,0 +1,53 @@
+"""Recall/latency of the IVF face index against the exact scan on synthetic 128-d encodings.
+
+Run from the repository root:
+
+    python -m benchmarks.face_index_benchmark
+"""
+import time
+import numpy as np
+from utils.face_index import ExactIndex, IVFIndex
+
+
+def synthetic_encodings(n_users, per_user, rng):
+    # dlib encodings have norm ~1 and same-person distances around 0.3; mimic that with clustered data
+    centers = rng.normal(size=(n_users, 128)).astype(np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    noise = rng.normal(scale=0.025, size=(n_users, per_user, 128)).astype(np.float32)
+    encodings = (centers[:, None, :] + noise).reshape(-1, 128)
+    return centers, encodings
+
+
+def timed_search(index, queries, k=1, batch=16):
+    # Queries are issued per frame, so measure in frame-sized batches
+    start = time.perf_counter()
+    results = [index.search(queries[i:i + batch], k)[0][:, 0] for i in range(0, len(queries), batch)]
+    elapsed = time.perf_counter() - start
+    return np.concatenate(results), elapsed / len(queries) * 1e3
+
+
+def run(sizes=(1000, 10000, 50000), per_user=2, n_queries=512, seed=0):
+    rng = np.random.default_rng(seed)
+    print(f"{'encodings':>10} {'index':>6} {'build ms':>9} {'ms/query':>9} {'recall@1':>9}")
+    for size in sizes:
+        centers, encodings = synthetic_encodings(size // per_user, per_user, rng)
+        picked = rng.choice(len(centers), size=n_queries)
+        queries = centers[picked] + rng.normal(scale=0.025, size=(n_queries, 128)).astype(np.float32)
+
+        start = time.perf_counter()
+        exact = ExactIndex(encodings)
+        exact_build = (time.perf_counter() - start) * 1e3
+        truth, exact_latency = timed_search(exact, queries)
+        print(f"{len(encodings):>10} {'exact':>6} {exact_build:>9.1f} {exact_latency:>9.3f} {1.0:>9.3f}")
+
+        for n_probe in (4, 8, 16):
+            start = time.perf_counter()
+            ivf = IVFIndex(encodings, n_probe=n_probe)
+            ivf_build = (time.perf_counter() - start) * 1e3
+            found, ivf_latency = timed_search(ivf, queries)
+            recall = float(np.mean(found == truth))
+            print(f"{'':>10} {'ivf/' + str(n_probe):>6} {ivf_build:>9.1f} {ivf_latency:>9.3f} {recall:>9.3f}")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,64 @@
+"""Memory and match decisions of compact (float16 / int8) known faces against float64 on synthetic encodings.
+
+A decision is the (user or no match) outcome at MATCH_TOLERANCE; the float64 reference is an exact
+scan in double precision. Run from the repository root:
+
+    python -m benchmarks.face_quantization_benchmark
+"""
+import time
+import numpy as np
+from benchmarks.face_index_benchmark import synthetic_encodings
+from utils.face_matching import MATCH_TOLERANCE, KnownFaces
+
+
+def reference_decisions(encodings, ids, queries, tolerance=MATCH_TOLERANCE, batch=64):
+    # Exact nearest neighbour in double precision, where the norm expansion loses nothing that matters
+    encodings = encodings.astype(np.float64)
+    sq_norms = np.einsum("ij,ij->i", encodings, encodings)
+    decisions, distances = [], []
+    for start in range(0, len(queries), batch):
+        block = queries[start:start + batch].astype(np.float64)
+        squared = np.einsum("ij,ij->i", block, block)[:, None] + sq_norms[None, :] - 2.0 * (block @ encodings.T)
+        best = squared.argmin(axis=1)
+        for row, index in enumerate(best):
+            distance = float(np.sqrt(max(squared[row, index], 0.0)))
+            decisions.append(ids[index] if distance < tolerance else None)
+            distances.append(distance)
+    return decisions, np.asarray(distances)
+
+
+def run(size=100000, per_user=2, n_queries=2000, seed=0):
+    rng = np.random.default_rng(seed)
+    centers, encodings = synthetic_encodings(size // per_user, per_user, rng)
+    ids = np.repeat(np.arange(len(centers)), per_user).astype(str)
+
+    # Half the queries are enrolled people, half strangers; the noise puts many distances near the threshold
+    known = centers[rng.choice(len(centers), size=n_queries // 2)]
+    strangers = rng.normal(size=(n_queries - len(known), 128)).astype(np.float32)
+    strangers /= np.linalg.norm(strangers, axis=1, keepdims=True)
+    queries = np.vstack([known, strangers]) + rng.normal(scale=0.025, size=(n_queries, 128)).astype(np.float32)
+
+    reference, reference_distances = reference_decisions(encodings, ids, queries)
+    near_threshold = int(np.sum(np.abs(reference_distances - MATCH_TOLERANCE) < 0.01))
+    float64_bytes = encodings.astype(np.float64).nbytes
+    print(f"{len(encodings)} encodings, {n_queries} queries ({near_threshold} within 0.01 of {MATCH_TOLERANCE})")
+    print(f"float64 matrix: {float64_bytes / 1e6:.1f} MB ({float64_bytes / len(encodings) * 100000 / 1e6:.1f} MB per 100k)")
+    print(f"{'dtype':>8} {'MB/100k':>8} {'build ms':>9} {'ms/query':>9} {'changed':>8} {'max |dd|':>9}")
+
+    for dtype in ("float32", "float16", "int8"):
+        start = time.perf_counter()
+        known_faces = KnownFaces(encodings, ids, index_kind="exact", encoding_dtype=dtype)
+        build_ms = (time.perf_counter() - start) * 1e3
+
+        start = time.perf_counter()
+        matches = [match for i in range(0, n_queries, 16) for match in known_faces.match(queries[i:i + 16])]
+        query_ms = (time.perf_counter() - start) / n_queries * 1e3
+
+        changed = sum(decision != user_id for decision, (user_id, _, _) in zip(reference, matches))
+        distance_error = np.max(np.abs(np.asarray([distance for _, distance, _ in matches]) - reference_distances))
+        matrix_mb = (known_faces.matrix.nbytes + known_faces.index.nbytes) / len(encodings) * 100000 / 1e6
+        print(f"{dtype:>8} {matrix_mb:>8.1f} {build_ms:>9.1f} {query_ms:>9.3f} {changed:>8} {distance_error:>9.5f}")
+
+
+if __name__ == "__main__":
+    run()
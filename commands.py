@@ -0,0 +1,66 @@
+import json
+import threading
+import click
+from flask import current_app
+
+from models import AttendanceSession
+from utils.face_utils import backfill_face_embeddings
+from utils.recognition_utils import DetectionSettings
+from utils.recognition_worker import RecognitionWorker
+from utils.video_sources import VideoSource
+
+
+def register_commands(app):
+    @app.cli.command("backfill-faces")
+    @click.option("--organization-id", type=int, default=None, help="Only backfill users of this organization.")
+    @click.option("--force", is_flag=True, help="Recompute embeddings even if they are up to date.")
+    def backfill_faces(organization_id, force):
+        """Compute and store face embeddings for users that have an image."""
+        result = backfill_face_embeddings(organization_id, force=force)
+        click.echo(
+            f"Enrolled {result['enrolled']} users, "
+            f"{result['no_face']} without a detectable face, {result['failed']} failed "
+            f"({result['seconds']:.1f}s)."
+        )
+
+    @app.cli.command("recognize-video")
+    @click.argument("streams", nargs=-1, required=True)
+    @click.option("--fps", type=float, default=None, help="Target frames per second.")
+    @click.option("--scale", type=float, default=None, help="Detection scale factor.")
+    @click.option("--interval", type=int, default=None, help="Detect every N frames.")
+    @click.option("--in-process", is_flag=True, help="Run on threads of this process instead of worker processes.")
+    def recognize_video(streams, fps, scale, interval, in_process):
+        """Run recognition headless for SESSION_ID=SOURCE pairs, e.g. recorded videos instead of cameras.
+
+        Every source gets its own worker, exactly as when viewers open /recognize/<session_id>;
+        attendance is written to the sessions and pipeline stats are printed when the sources end.
+        """
+        args = {key: value for key, value in (("fps", fps), ("scale", scale), ("interval", interval)) if value is not None}
+        settings = DetectionSettings.from_args(args)
+
+        workers = []
+        for stream in streams:
+            session_id, _, spec = stream.partition("=")
+            session = AttendanceSession.query.get(int(session_id)) if session_id.isdigit() else None
+            if session is None or not spec:
+                raise click.BadParameter(f"Expected SESSION_ID=SOURCE for an existing session, got {stream!r}.")
+            source = VideoSource(spec).validate()
+            workers.append(RecognitionWorker(
+                current_app._get_current_object(), session.id, session.organization_id, settings, source,
+                use_process=not in_process
+            ))
+
+        def drain(subscriber):
+            while subscriber.next_frame() is not None:
+                pass
+
+        drains = []
+        for worker in workers:
+            drains.append(threading.Thread(target=drain, args=(worker.subscribe(),), daemon=True))
+            worker.start()
+        for thread in drains:
+            thread.start()
+        for worker in workers:
+            worker.join()
+
+        click.echo(json.dumps([worker.stats() for worker in workers], indent=2))
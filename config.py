@@ -12,6 +12,88 @@ db = SQLAlchemy()
 
 SECRET_KEY=os.getenv('SECRET_KEY')
 
+# How long a token's user is cached per process before it is looked up again (edits invalidate it sooner),
+# and how many users each process keeps at most
+AUTH_USER_CACHE_SECONDS = float(os.getenv('AUTH_USER_CACHE_SECONDS', 30))
+AUTH_USER_CACHE_SIZE = int(os.getenv('AUTH_USER_CACHE_SIZE', 10000))
+# Password hashing pool: processes, hashes in flight before callers wait, and how long they wait (then 503).
+# PASSWORD_HASH_METHOD is passed to werkzeug (e.g. "pbkdf2:sha256:600000"); older hashes are upgraded on login
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', 2))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv('PASSWORD_HASH_MAX_PENDING', 8))
+PASSWORD_HASH_WAIT_SECONDS = float(os.getenv('PASSWORD_HASH_WAIT_SECONDS', 10))
+PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', '')
+
+# Face enrollment pipeline: concurrent image downloads and encoder processes. Every web worker starts
+# its own encoder pool, so keep web workers x FACE_ENCODE_WORKERS at or below the number of cores
+FACE_DOWNLOAD_WORKERS = int(os.getenv('FACE_DOWNLOAD_WORKERS', 8))
+FACE_ENCODE_WORKERS = int(os.getenv('FACE_ENCODE_WORKERS', 2))
+# Uploaded and profile images are detected on a copy whose longest side is at most this (0 = full size)
+FACE_DETECT_MAX_DIMENSION = int(os.getenv('FACE_DETECT_MAX_DIMENSION', 1600))
+# Quality prefilter before encoding (0 disables a rule): minimum face box side in pixels, minimum
+# Laplacian variance of the face crop and maximum nose offset from the eye midpoint per eye distance
+FACE_MIN_SIZE = int(os.getenv('FACE_MIN_SIZE', 40))
+FACE_MIN_SHARPNESS = float(os.getenv('FACE_MIN_SHARPNESS', 20))
+FACE_MAX_YAW = float(os.getenv('FACE_MAX_YAW', 0.4))
+# Disk cache of downloaded profile images (empty directory to disable)
+IMAGE_CACHE_DIR = os.getenv('IMAGE_CACHE_DIR', 'image_cache')
+IMAGE_CACHE_MAX_BYTES = int(os.getenv('IMAGE_CACHE_MAX_MB', 1024)) * 1024 * 1024
+# Background enrollment: worker threads per process, download attempts and the first retry delay (doubling)
+ENROLLMENT_WORKERS = int(os.getenv('ENROLLMENT_WORKERS', 2))
+ENROLLMENT_MAX_ATTEMPTS = int(os.getenv('ENROLLMENT_MAX_ATTEMPTS', 5))
+ENROLLMENT_RETRY_SECONDS = float(os.getenv('ENROLLMENT_RETRY_SECONDS', 2))
+
+# Face matching index: "auto" switches from exact scan to IVF at FACE_ANN_THRESHOLD encodings
+FACE_INDEX_KIND = os.getenv('FACE_INDEX_KIND', 'auto')
+FACE_ANN_THRESHOLD = int(os.getenv('FACE_ANN_THRESHOLD', 20000))
+# Cached encodings as float32, or compact float16 / int8 (see benchmarks/face_quantization_benchmark.py)
+FACE_ENCODING_DTYPE = os.getenv('FACE_ENCODING_DTYPE', 'float32')
+
+# Memory budget for cached known faces across all organizations
+FACE_CACHE_MAX_BYTES = int(os.getenv('FACE_CACHE_MAX_MB', 512)) * 1024 * 1024
+# How often a cached organization is diffed against per-user versions in the database
+FACE_CACHE_REVALIDATE_SECONDS = int(os.getenv('FACE_CACHE_REVALIDATE_SECONDS', 60))
+# Directory of the memory-mapped known faces shared by worker processes (empty to disable)
+FACE_STORE_DIR = os.getenv('FACE_STORE_DIR', 'face_store')
+# Each organization's file is rewritten in the background at most this often
+FACE_STORE_WRITE_SECONDS = float(os.getenv('FACE_STORE_WRITE_SECONDS', 10))
+
+# Recognition stream defaults, overridable per stream with ?fps=&scale=&interval=
+RECOGNITION_TARGET_FPS = float(os.getenv('RECOGNITION_TARGET_FPS', 15))
+RECOGNITION_SCALE = float(os.getenv('RECOGNITION_SCALE', 0.5))
+RECOGNITION_DETECT_INTERVAL = int(os.getenv('RECOGNITION_DETECT_INTERVAL', 3))
+# Frames buffered per stream viewer before older ones are dropped
+RECOGNITION_CLIENT_BUFFER = int(os.getenv('RECOGNITION_CLIENT_BUFFER', 2))
+# Frames queued between capture and JPEG streaming before the oldest is dropped
+RECOGNITION_STAGE_BUFFER = int(os.getenv('RECOGNITION_STAGE_BUFFER', 4))
+# How often a running stream re-checks known faces for new or changed enrollments
+RECOGNITION_REFRESH_SECONDS = float(os.getenv('RECOGNITION_REFRESH_SECONDS', 30))
+# Camera used when neither the session nor its organization has a video_source
+RECOGNITION_DEFAULT_SOURCE = os.getenv('RECOGNITION_DEFAULT_SOURCE', '0')
+# Comma-separated further sources supervisors may pick for a session, besides the default and their
+# organization's video_source (which admins set)
+RECOGNITION_ALLOWED_SOURCES = [spec.strip() for spec in os.getenv('RECOGNITION_ALLOWED_SOURCES', '').split(',') if spec.strip()]
+# Run each source's recognition pipeline in its own process, with this many encoder processes each
+RECOGNITION_WORKER_PROCESSES = os.getenv('RECOGNITION_WORKER_PROCESSES', 'true').lower() in ('1', 'true', 'yes')
+RECOGNITION_PROCESS_ENCODE_WORKERS = int(os.getenv('RECOGNITION_PROCESS_ENCODE_WORKERS', 1))
+# Lock files that make each video source exclusive across the web processes of a host (empty to disable)
+RECOGNITION_LOCK_DIR = os.getenv('RECOGNITION_LOCK_DIR', 'recognition_locks')
+# MJPEG output defaults per viewer, overridable with ?width=&quality=&max_fps=&adaptive=
+MJPEG_MAX_WIDTH = int(os.getenv('MJPEG_MAX_WIDTH', 960))
+MJPEG_QUALITY = int(os.getenv('MJPEG_QUALITY', 80))
+MJPEG_MAX_FPS = float(os.getenv('MJPEG_MAX_FPS', 15))
+# Upper bound on images (including zip entries) per POST /recognize/<session_id>/images
+RECOGNITION_MAX_UPLOAD_IMAGES = int(os.getenv('RECOGNITION_MAX_UPLOAD_IMAGES', 100))
+# Size limits for those uploads: per image once decompressed, and for all images together. The request
+# body itself is capped at the total as well (MAX_CONTENT_LENGTH)
+RECOGNITION_MAX_IMAGE_BYTES = int(os.getenv('RECOGNITION_MAX_IMAGE_MB', 20)) * 1024 * 1024
+RECOGNITION_MAX_UPLOAD_BYTES = int(os.getenv('RECOGNITION_MAX_UPLOAD_MB', 200)) * 1024 * 1024
+
+# Recognized attendance is written every ATTENDANCE_FLUSH_SIZE users or ATTENDANCE_FLUSH_SECONDS
+ATTENDANCE_FLUSH_SIZE = int(os.getenv('ATTENDANCE_FLUSH_SIZE', 20))
+ATTENDANCE_FLUSH_SECONDS = float(os.getenv('ATTENDANCE_FLUSH_SECONDS', 5))
+# Upper bound on (session, user) pairs per POST /attendance/mark/bulk
+ATTENDANCE_BULK_MAX_ROWS = int(os.getenv('ATTENDANCE_BULK_MAX_ROWS', 5000))
+
 def configure_db(app):
     app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL')
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
@@ -1,59 +1,125 @@
-from flask import jsonify, request
-import jwt
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from flask import g, jsonify
+from flask_jwt_extended import get_jwt, get_jwt_identity, verify_jwt_in_request
+from flask_jwt_extended.exceptions import JWTExtendedException, NoAuthorizationError
 from functools import wraps
+from jwt import ExpiredSignatureError, InvalidTokenError
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
 
-from config import SECRET_KEY
+from config import AUTH_USER_CACHE_SECONDS, AUTH_USER_CACHE_SIZE
 from models import User
 
-# Middleware to check if the user is an admin
-def admin_required(f):
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        # Extract token from the 'Authorization' header
-        token = request.headers.get("Authorization")
-        if not token:
-            return jsonify({"error": "Unauthorized"}), 401
-        
-        # Remove the 'Bearer ' prefix if present
-        if token.startswith("Bearer "):
-            token = token.split("Bearer ")[1]
-        
-        try:
-            payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
-            user = User.query.filter_by(user_id=payload["user_id"]).first()
-            if not user or user.role != "admin":
-                return jsonify({"error": "Admin access required"}), 403
-        except jwt.ExpiredSignatureError:
-            return jsonify({"error": "Token has expired"}), 401
-        except jwt.InvalidTokenError:
-            return jsonify({"error": "Invalid token"}), 401
-
-        return f(*args, **kwargs)
-    return decorated_function
+# What routes need to know about the requesting user. Cached instead of User objects, which belong
+# to the session that loaded them.
+AuthUser = namedtuple("AuthUser", ["id", "user_id", "name", "email", "organization_id", "role"])
+
+
+class UserCache:
+    """Short-lived per-process cache of AuthUser by user_id, the identity in our tokens.
+
+    Entries are dropped when a user is edited or deleted in this process; other processes see
+    the change once their entry expires. At most max_entries are kept, least recently used first out.
+    """
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                return entry[1]
+
+        user = User.query.filter_by(user_id=user_id).first()
+        auth_user = AuthUser(user.id, user.user_id, user.name, user.email, user.organization_id, user.role) if user else None
+        with self._lock:
+            self._entries[user_id] = (now + self.ttl, auth_user)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return auth_user
+
+    def invalidate(self, user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+user_cache = UserCache(AUTH_USER_CACHE_SECONDS, AUTH_USER_CACHE_SIZE)
+
+
+def get_current_user():
+    # The requesting user as an AuthUser (None if it no longer exists), resolved once per request.
+    # Needs a verified token: use under @jwt_required() or one of the decorators below.
+    if "current_user" not in g:
+        g.current_user = user_cache.get(get_jwt_identity())
+    return g.current_user
+
 
+def get_current_role():
+    # generate_jwt_token puts the role in the token, so checking it needs no lookup
+    role = get_jwt().get("role")
+    if role is None:
+        user = get_current_user()
+        role = user.role if user else None
+    return role
+
+
+def role_required(role, message):
+    # Verifies the token itself, so don't stack @jwt_required() on top (that would decode it twice)
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            try:
+                verify_jwt_in_request()
+            except NoAuthorizationError:
+                return jsonify({"error": "Unauthorized"}), 401
+            except ExpiredSignatureError:
+                return jsonify({"error": "Token has expired"}), 401
+            except (InvalidTokenError, JWTExtendedException):
+                return jsonify({"error": "Invalid token"}), 401
+
+            if get_current_role() != role or get_current_user() is None:
+                return jsonify({"error": message}), 403
+
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+
+# Middleware to check if the user is an admin
+admin_required = role_required("admin", "Admin access required")
 
 # Middleware to check if the user is a supervisor
-def supervisor_required(f):
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        # Extract token from the 'Authorization' header
-        token = request.headers.get("Authorization")
-        if not token:
-            return jsonify({"error": "Unauthorized"}), 401
-        
-        # Remove the 'Bearer ' prefix if present
-        if token.startswith("Bearer "):
-            token = token.split("Bearer ")[1]
-        
-        try:
-            payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
-            user = User.query.filter_by(user_id=payload["user_id"]).first()
-            if not user or user.role != "supervisor":
-                return jsonify({"error": "Supervisor access required"}), 403
-        except jwt.ExpiredSignatureError:
-            return jsonify({"error": "Token has expired"}), 401
-        except jwt.InvalidTokenError:
-            return jsonify({"error": "Invalid token"}), 401
-
-        return f(*args, **kwargs)
-    return decorated_function
+supervisor_required = role_required("supervisor", "Supervisor access required")
+
+
+# Drop cached users when they change; user_id is tracked before and after an edit
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _user_changed(mapper, connection, target):
+    stale = inspect(target).session.info.setdefault("stale_auth_users", set())
+    stale.add(target.user_id)
+    stale.update(inspect(target).attrs.user_id.history.deleted or ())
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_auth_users(session):
+    user_cache.invalidate(session.info.pop("stale_auth_users", ()))
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_auth_users(session):
+    session.info.pop("stale_auth_users", None)
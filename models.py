@@ -1,11 +1,16 @@
 from datetime import datetime, timezone
-from config import db
-from werkzeug.security import generate_password_hash, check_password_hash
+from config import db, PASSWORD_HASH_MAX_PENDING, PASSWORD_HASH_METHOD, PASSWORD_HASH_WAIT_SECONDS, PASSWORD_HASH_WORKERS
+from utils.password_hashing import PasswordHasher
+
+# Hashing is CPU-bound (hundreds of ms by design), so it runs off the request threads
+password_hasher = PasswordHasher(PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING, PASSWORD_HASH_WAIT_SECONDS,
+                                 PASSWORD_HASH_METHOD)
 
 class Organization(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), unique=True, nullable=False)
     description = db.Column(db.Text, nullable=True)
+    video_source = db.Column(db.String(255), nullable=True)  # Default camera for recognition (see utils/video_sources.py)
     users = db.relationship('User', backref='organization', lazy=True, cascade="all, delete-orphan")
     sessions = db.relationship('AttendanceSession', backref='organization', lazy=True, cascade="all, delete-orphan")
 
@@ -20,12 +25,18 @@ class User(db.Model):
     role = db.Column(db.Enum('admin', 'supervisor', 'user', name='user_roles'), nullable=False, default='student')
     sessions_created = db.relationship('AttendanceSession', backref='creator', lazy=True)
     records = db.relationship('AttendanceRecord', backref='user', lazy=True)
+    face_embeddings = db.relationship('FaceEmbedding', backref='user', lazy=True, cascade="all, delete-orphan")
+    face_enrollment = db.relationship('FaceEnrollment', backref='user', uselist=False, cascade="all, delete-orphan")
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return password_hasher.verify(self.password_hash, password)
+
+    def password_needs_rehash(self):
+        # Stored with other parameters than PASSWORD_HASH_METHOD currently produces
+        return password_hasher.needs_rehash(self.password_hash)
 
 class AttendanceSession(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -34,6 +45,7 @@ class AttendanceSession(db.Model):
     date = db.Column(db.Date, default=datetime.now(timezone.utc).date())
     organization_id = db.Column(db.Integer, db.ForeignKey('organization.id'), nullable=False)
     creator_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)  # Created by admin/supervisor
+    video_source = db.Column(db.String(255), nullable=True)  # Overrides the organization's camera
     records = db.relationship('AttendanceRecord', backref='session', cascade="all, delete-orphan", lazy=True)
 
 class AttendanceRecord(db.Model):
@@ -42,3 +54,23 @@ class AttendanceRecord(db.Model):
     user_id = db.Column(db.String(50), db.ForeignKey('user.user_id'), nullable=False)  # Foreign key references user_id
     timestamp = db.Column(db.DateTime, default=datetime.now(timezone.utc))
     __table_args__ = (db.UniqueConstraint('session_id', 'user_id', name='unique_attendance_record'),)
+
+class FaceEmbedding(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    # References user.id rather than user.user_id, which can be changed through /users/edit
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False, index=True)
+    encoding = db.Column(db.LargeBinary, nullable=False)  # 128 float64 values from face_recognition
+    image_url = db.Column(db.String(255), nullable=False)  # Image the encoding was computed from
+    image_hash = db.Column(db.String(64), nullable=False)  # SHA-256 of the downloaded image bytes
+    model_version = db.Column(db.String(50), nullable=False)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+
+class FaceEnrollment(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False, unique=True)
+    image_url = db.Column(db.String(255), nullable=False)  # Image the status refers to
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, ok, no_face or failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.String(255), nullable=True)
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc),
+                           onupdate=lambda: datetime.now(timezone.utc))
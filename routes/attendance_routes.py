@@ -1,14 +1,11 @@
-from flask import Blueprint, after_this_request, request, jsonify, current_app, send_file
-import pandas as pd
-from config import db
-from models import AttendanceRecord, AttendanceSession, User
-import tempfile
-import os
-from sqlalchemy.orm import joinedload
-from sqlalchemy import func
-from flask_jwt_extended import jwt_required, get_jwt_identity
-
-from middleware import supervisor_required
+from flask import Blueprint, Response, request, jsonify, current_app, stream_with_context
+from config import db, ATTENDANCE_BULK_MAX_ROWS
+from models import AttendanceSession, User
+from flask_jwt_extended import jwt_required
+
+from middleware import get_current_user, supervisor_required
+from utils.attendance_export import attendance_export_rows, generate_csv, generate_xlsx
+from utils.attendance_utils import insert_attendance_records, sessions_with_records_count
 from utils.pagination_utils import paginate_query
 
 attendance_bp = Blueprint('attendance', __name__)
@@ -18,16 +15,15 @@ attendance_bp = Blueprint('attendance', __name__)
 @jwt_required()
 def get_attendance_sessions():
     try:
-        user_id = get_jwt_identity()
-        user = User.query.get(user_id)
+        user = get_current_user()
         if not user:
             return jsonify({"message": "User not found."}), 404
 
         page = int(request.args.get("page", 1))
         per_page = int(request.args.get("per_page", 10))
 
-        # Query attendance sessions for the user's organization
-        query = AttendanceSession.query.filter_by(organization_id=user.organization_id)
+        # Query attendance sessions for the user's organization, with their record counts in the same query
+        query = sessions_with_records_count(user.organization_id)
         sessions, page, per_page, total_pages, total_sessions = paginate_query(query, page, per_page)
 
         data = [
@@ -36,13 +32,11 @@ def get_attendance_sessions():
                 "title": session.title,
                 "description": session.description,
                 "date": session.date,
-                "records_count": db.session.query(func.count(AttendanceRecord.id))
-                                    .filter_by(session_id=session.id)
-                                    .scalar(),
+                "records_count": records_count,
                 "organization_id": session.organization_id,
                 "creator_id": session.creator_id
             }
-            for session in sessions
+            for session, records_count in sessions
         ]
 
         return jsonify({
@@ -61,8 +55,7 @@ def get_attendance_sessions():
 @jwt_required()
 def download_attendance_session(session_id):
     try:
-        user_id = get_jwt_identity()
-        user = User.query.get(user_id)
+        user = get_current_user()
         if not user:
             return jsonify({"message": "User not found."}), 404
 
@@ -70,42 +63,26 @@ def download_attendance_session(session_id):
         if not session or session.organization_id != user.organization_id:
             return jsonify({"message": "Attendance session not found or access denied."}), 403
 
-        records = AttendanceRecord.query.filter_by(session_id=session_id).all()
-        users = User.query.filter_by(organization_id=session.organization_id).all()
+        # Both formats are streamed while the rows are read; the default stays an Excel workbook
+        export_format = request.args.get("format", "xlsx").lower()
+        if export_format not in ("xlsx", "csv"):
+            return jsonify({"message": "format must be xlsx or csv."}), 400
 
-        data = [
-            {
-                "User ID": user.user_id,
-                "Name": user.name,
-                "Email": user.email,
-                "Status": "Present" if any(r.user_id == user.user_id for r in records) else "Absent"
-            }
-            for user in users
-        ]
-
-        df = pd.DataFrame(data)
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as temp_file:
-            temp_path = temp_file.name
-            df.to_excel(temp_path, index=False)
+        filename = f"attendance_session_{session_id}.{export_format}"
+        headers = {"Content-Disposition": f"attachment; filename={filename}"}
+        if export_format == "csv":
+            return Response(stream_with_context(generate_csv(attendance_export_rows(session))),
+                            mimetype="text/csv", headers=headers)
 
-        response = send_file(temp_path, as_attachment=True, download_name=f"attendance_session_{session_id}.xlsx")
-
-        @after_this_request
-        def cleanup(response):
-            try:
-                os.remove(temp_path)
-            except Exception as e:
-                current_app.logger.error(f"Error deleting temp file: {e}")
-            return response
-
-        return response
+        return Response(stream_with_context(generate_xlsx(attendance_export_rows(session))),
+                        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                        headers=headers)
     except Exception as e:
         current_app.logger.error(f"Error downloading attendance session: {e}")
         return jsonify({"message": "An error occurred while downloading the attendance session."}), 500
 
 
 @attendance_bp.route('/mark', methods=["POST"])
-@jwt_required()
 @supervisor_required 
 def mark_attendance():
     try:
@@ -116,15 +93,74 @@ def mark_attendance():
         if not user_id or not session_id:
             return jsonify({"message": "User ID and session ID are required."}), 400
 
-        # Check if attendance already exists
-        if db.session.query(AttendanceRecord.id).filter_by(user_id=user_id, session_id=session_id).first():
+        # Skipped by the unique constraint if already recorded, so concurrent marks can't both insert
+        if not insert_attendance_records([(session_id, user_id)]):
             return jsonify({"message": "User has already been marked present."}), 409
 
-        new_record = AttendanceRecord(user_id=user_id, session_id=session_id)
-        db.session.add(new_record)
-        db.session.commit()
-
         return jsonify({"message": "Attendance recorded successfully!"}), 201
     except Exception as e:
+        db.session.rollback()
         current_app.logger.error(f"Error marking attendance: {e}")
         return jsonify({"message": "An error occurred while marking attendance."}), 500
+
+
+def read_bulk_marks(data):
+    # {"session_id": 1, "user_ids": [...]} or {"sessions": [{"session_id": 1, "user_ids": [...]}, ...]}
+    entries = data.get("sessions") if isinstance(data, dict) and "sessions" in data else [data]
+    if not isinstance(entries, list) or not entries:
+        raise ValueError("Provide session_id and user_ids, or a list of sessions.")
+
+    rows = []
+    for entry in entries:
+        if not isinstance(entry, dict):
+            raise ValueError("Every session must be an object.")
+        session_id, user_ids = entry.get("session_id"), entry.get("user_ids")
+        # bool is an int subclass, so true/false have to be turned away explicitly
+        if not isinstance(session_id, int) or isinstance(session_id, bool) or not isinstance(user_ids, list):
+            raise ValueError("Every session needs an integer session_id and a list of user_ids.")
+        for user_id in user_ids:
+            if not isinstance(user_id, (str, int)) or isinstance(user_id, bool):
+                raise ValueError("user_ids must be strings or numbers.")
+            rows.append((session_id, str(user_id)))
+    return list(dict.fromkeys(rows))
+
+
+@attendance_bp.route('/mark/bulk', methods=["POST"])
+@supervisor_required
+def mark_attendance_bulk():
+    try:
+        rows = read_bulk_marks(request.get_json() or {})
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    if len(rows) > ATTENDANCE_BULK_MAX_ROWS:
+        return jsonify({"message": f"At most {ATTENDANCE_BULK_MAX_ROWS} attendance marks can be sent at once."}), 413
+
+    try:
+        organization_id = get_current_user().organization_id
+        session_ids = {session_id for session_id, _ in rows}
+        found = {session_id for session_id, in db.session.query(AttendanceSession.id).filter(
+            AttendanceSession.id.in_(session_ids), AttendanceSession.organization_id == organization_id
+        )}
+        if found != session_ids:
+            return jsonify({
+                "message": "Attendance session not found or access denied.",
+                "session_ids": sorted(session_ids - found),
+            }), 404
+
+        # All sessions belong to the supervisor's organization, so one query validates every user
+        members = {user_id for user_id, in db.session.query(User.user_id).filter(
+            User.organization_id == organization_id, User.user_id.in_({user_id for _, user_id in rows})
+        )}
+        valid = [(session_id, user_id) for session_id, user_id in rows if user_id in members]
+        inserted = insert_attendance_records(valid)
+
+        return jsonify({
+            "message": "Attendance recorded successfully!",
+            "inserted": inserted,
+            "skipped": len(valid) - inserted,
+            "invalid_user_ids": sorted({user_id for _, user_id in rows if user_id not in members}),
+        }), 200
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error marking attendance in bulk: {e}")
+        return jsonify({"message": "An error occurred while marking attendance."}), 500
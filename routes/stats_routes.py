@@ -1,8 +1,11 @@
 from flask import Blueprint, request, jsonify, current_app
-from models import AttendanceRecord, AttendanceSession, User, Organization
+from models import User
 from config import db
 from sqlalchemy import func
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask_jwt_extended import jwt_required
+
+from middleware import get_current_user
+from utils.attendance_utils import sessions_with_records_count
 
 stats_bp = Blueprint('stats', __name__)
 
@@ -11,8 +14,7 @@ stats_bp = Blueprint('stats', __name__)
 def get_statistics():
     try:
         # Get the authenticated user
-        user_id = get_jwt_identity()
-        user = User.query.get(user_id)
+        user = get_current_user()
         if not user:
             return jsonify({"message": "User not found."}), 404
 
@@ -22,20 +24,18 @@ def get_statistics():
 
         organization_id = user.organization_id
 
-        # Get total users, sessions, and records for the organization
+        # Get total users, and every session with its record count in one query
         total_users = db.session.query(func.count(User.id)).filter_by(organization_id=organization_id).scalar()
-        total_sessions = db.session.query(func.count(AttendanceSession.id)).filter_by(organization_id=organization_id).scalar()
-        total_records = db.session.query(func.count(AttendanceRecord.id)).join(AttendanceSession).filter(AttendanceSession.organization_id == organization_id).scalar()
+        sessions = sessions_with_records_count(organization_id).all()
+        total_sessions = len(sessions)
+        total_records = sum(attendance_count for _, attendance_count in sessions)
 
         # Calculate average attendance rate (percentage)
         average_attendance_rate = (total_records / (total_users * total_sessions) * 100) if total_users > 0 and total_sessions > 0 else 0
 
         # Get session-wise breakdown with record counts
         session_stats = []
-        sessions = AttendanceSession.query.filter_by(organization_id=organization_id).all()
-        
-        for session in sessions:
-            attendance_count = db.session.query(func.count(AttendanceRecord.id)).filter_by(session_id=session.id).scalar()
+        for session, attendance_count in sessions:
             session_stats.append({
                 "session_id": session.id,
                 "title": session.title,
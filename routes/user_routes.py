@@ -1,10 +1,10 @@
 from flask import Blueprint, after_this_request, request, jsonify, current_app, send_file
-from flask_jwt_extended import get_jwt_identity, jwt_required
-import pandas as pd
-import tempfile
-from middleware import supervisor_required
-from models import AttendanceRecord, AttendanceSession, User, Organization
+from flask_jwt_extended import jwt_required
+from sqlalchemy import func
+from middleware import get_current_role, get_current_user, supervisor_required
+from models import AttendanceRecord, AttendanceSession, FaceEnrollment, User, Organization
 from config import db
+from utils.face_utils import enrollment_queue, schedule_enrollment
 import os
 
 user_bp = Blueprint('user', __name__)
@@ -14,8 +14,7 @@ user_bp = Blueprint('user', __name__)
 @jwt_required()
 def get_all_users():
     try:
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
+        current_user = get_current_user()
         if not current_user:
             return jsonify({"message": "Unauthorized access."}), 403
 
@@ -49,12 +48,83 @@ def get_all_users():
         return jsonify({"message": "An error occurred while fetching users."}), 500
 
 
+# Face enrollment status counts for the organization, optionally listing users with one status
+@user_bp.route("/enrollment", methods=["GET"])
+@supervisor_required
+def get_enrollment_overview():
+    current_user = get_current_user()
+    if not current_user:
+        return jsonify({"message": "Unauthorized access."}), 403
+
+    counts = dict(
+        db.session.query(FaceEnrollment.status, func.count(FaceEnrollment.id))
+        .join(User, User.id == FaceEnrollment.user_id)
+        .filter(User.organization_id == current_user.organization_id)
+        .group_by(FaceEnrollment.status)
+        .all()
+    )
+    response = {"counts": counts, "queue": enrollment_queue.stats()}
+
+    status = request.args.get("status")
+    if status:
+        try:
+            limit = int(request.args.get("limit", 100))
+        except ValueError:
+            return jsonify({"message": "limit must be an integer."}), 400
+        limit = min(max(limit, 1), 1000)
+        users = (
+            db.session.query(User.user_id, FaceEnrollment.attempts, FaceEnrollment.error, FaceEnrollment.updated_at)
+            .join(FaceEnrollment, FaceEnrollment.user_id == User.id)
+            .filter(User.organization_id == current_user.organization_id, FaceEnrollment.status == status)
+            .order_by(FaceEnrollment.updated_at.desc())
+            .limit(limit)
+            .all()
+        )
+        response["users"] = [
+            {"user_id": user_id, "attempts": attempts, "error": error, "updated_at": updated_at}
+            for user_id, attempts, error, updated_at in users
+        ]
+
+    return jsonify(response), 200
+
+
+# Face enrollment status of one user
+@user_bp.route("/<user_id>/enrollment", methods=["GET"])
+@jwt_required()
+def get_user_enrollment(user_id):
+    current_user = get_current_user()
+    if not current_user:
+        return jsonify({"message": "Unauthorized access."}), 403
+    user = User.query.filter_by(user_id=user_id, organization_id=current_user.organization_id).first()
+    if not user:
+        return jsonify({"message": "User not found or not in your organization."}), 404
+
+    enrollment = user.face_enrollment
+    if not user.image_url:
+        status = "no_image"
+    elif enrollment is None or enrollment.image_url != user.image_url:
+        # Enrolled before statuses were tracked, or not yet picked up
+        status = "ok" if any(e.image_url == user.image_url for e in user.face_embeddings) else "pending"
+    else:
+        status = enrollment.status
+
+    return jsonify({
+        "user_id": user.user_id,
+        "image_url": user.image_url,
+        "status": status,
+        "attempts": enrollment.attempts if enrollment else 0,
+        "error": enrollment.error if enrollment else None,
+        "updated_at": enrollment.updated_at if enrollment else None,
+    }), 200
+
+
 # Get a user's attendance (filtered by organization)
 @user_bp.route("/<user_id>", methods=["GET"])
 @jwt_required()
 def get_user_attendance(user_id):
-    current_user_id = get_jwt_identity()
-    current_user = User.query.get(current_user_id)
+    current_user = get_current_user()
+    if not current_user:
+        return jsonify({"message": "Unauthorized access."}), 403
     user = User.query.filter_by(user_id=user_id, organization_id=current_user.organization_id).first()
     if not user:
         return jsonify({"message": "User not found or not in your organization."}), 404
@@ -85,11 +155,11 @@ def get_user_attendance(user_id):
 
 # Delete user
 @user_bp.route("/delete/<user_id>", methods=["DELETE"])
-@jwt_required()
 @supervisor_required 
 def delete_user(user_id):
-    current_user_id = get_jwt_identity()
-    current_user = User.query.get(current_user_id)
+    current_user = get_current_user()
+    if not current_user:
+        return jsonify({"message": "Unauthorized access."}), 403
     user = User.query.filter_by(user_id=user_id, organization_id=current_user.organization_id).first()
     if not user:
         return jsonify({"message": "User not found or not in your organization."}), 404
@@ -104,14 +174,15 @@ def delete_user(user_id):
 @user_bp.route("/edit/<int:id>", methods=["PUT"])
 @jwt_required()
 def edit_user(id):
-    current_user_id = get_jwt_identity()
-    current_user = User.query.get(current_user_id)
+    current_user = get_current_user()
+    if not current_user:
+        return jsonify({"message": "Unauthorized access."}), 403
     user = User.query.filter_by(id=id, organization_id=current_user.organization_id).first()
     if not user:
         return jsonify({"message": "User not found or not in your organization."}), 404
 
     # Allow supervisors or the user themselves to edit
-    if current_user.role != "supervisor" and current_user_id != user.id:
+    if get_current_role() != "supervisor" and current_user.id != user.id:
         return jsonify({"message": "Unauthorized access."}), 403
 
     data = request.get_json()
@@ -131,11 +202,14 @@ def edit_user(id):
         user.user_id = user_id
     if image_url:
         user.image_url = image_url
+        # Recompute the stored face embedding for the new image in the background
+        schedule_enrollment([user])
 
     try:
         db.session.commit()
-        return jsonify({"message": "User details updated successfully!"}), 200
     except Exception as e:
         current_app.logger.error(f"Error updating user: {e}")
         db.session.rollback()
         return jsonify({"message": "An error occurred while updating user details."}), 500
+
+    return jsonify({"message": "User details updated successfully!"}), 200
@@ -0,0 +1,145 @@
+import csv
+import io
+import re
+import zipfile
+from sqlalchemy import and_
+from xml.sax.saxutils import escape
+
+from config import db
+from models import AttendanceRecord, User
+
+EXPORT_COLUMNS = ["User ID", "Name", "Email", "Status"]
+
+# Rows fetched per round trip; with stream_results the driver uses a server-side cursor
+EXPORT_BATCH_SIZE = 1000
+
+# Response chunks are sent once this much output has accumulated
+CHUNK_BYTES = 64 * 1024
+
+
+def attendance_export_rows(session):
+    """Yield (user_id, name, email, status) for every member of the session's organization.
+
+    Presence comes from a LEFT JOIN on the session's records, so nothing is matched in Python,
+    and rows are read in batches rather than loaded all at once.
+    """
+    query = (
+        db.session.query(User.user_id, User.name, User.email, AttendanceRecord.id)
+        .outerjoin(AttendanceRecord, and_(AttendanceRecord.user_id == User.user_id,
+                                          AttendanceRecord.session_id == session.id))
+        .filter(User.organization_id == session.organization_id)
+        .order_by(User.id)
+        .execution_options(stream_results=True, yield_per=EXPORT_BATCH_SIZE)
+    )
+    for user_id, name, email, record_id in query:
+        yield user_id, name, email, "Present" if record_id is not None else "Absent"
+
+
+def generate_csv(rows):
+    # Chunks of about 64 KB, so the response is sent while rows are still being read
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= CHUNK_BYTES:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+XLSX_PARTS = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="xl/workbook.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+        '</Relationships>'
+    ),
+    "xl/workbook.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Attendance" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="worksheets/sheet1.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+        '</Relationships>'
+    ),
+}
+
+SHEET_HEADER = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+)
+SHEET_FOOTER = "</sheetData></worksheet>"
+
+# Control characters XML 1.0 can't represent
+_INVALID_XML = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+def _sheet_row(number, values):
+    cells = "".join(
+        f'<c r="{column}{number}" t="inlineStr"><is><t>{escape(_INVALID_XML.sub("", str(value)))}</t></is></c>'
+        for column, value in zip("ABCDEFGHIJKLMNOPQRSTUVWXYZ", values) if value is not None
+    )
+    return f'<row r="{number}">{cells}</row>'
+
+
+class _ChunkSink:
+    """Write-only file object for ZipFile that collects output until it is taken as a chunk."""
+
+    def __init__(self):
+        self._chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b"".join(self._chunks)
+        self._chunks, self.size = [], 0
+        return data
+
+
+def generate_xlsx(rows):
+    """Stream a one-sheet workbook while rows are still being read.
+
+    The sink has no seek or tell, so ZipFile writes each entry's sizes and CRC after its data
+    (data descriptors) and the archive can be sent as it is produced, with no temporary file.
+    Strings are written inline, which spares the shared string table a full pass would need.
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, content in XLSX_PARTS.items():
+            archive.writestr(name, content)
+        with archive.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as sheet:
+            sheet.write(SHEET_HEADER.encode())
+            sheet.write(_sheet_row(1, EXPORT_COLUMNS).encode())
+            for number, row in enumerate(rows, start=2):
+                sheet.write(_sheet_row(number, row).encode())
+                if sink.size >= CHUNK_BYTES:
+                    yield sink.take()
+            sheet.write(SHEET_FOOTER.encode())
+    yield sink.take()
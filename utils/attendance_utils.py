@@ -0,0 +1,141 @@
+import threading
+import time
+from datetime import datetime, timezone
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from config import db, ATTENDANCE_FLUSH_SIZE, ATTENDANCE_FLUSH_SECONDS
+from models import AttendanceRecord, AttendanceSession
+
+
+def insert_attendance_records(rows, commit=True):
+    """Insert (session_id, user_id) pairs in one statement, skipping ones already recorded.
+
+    Duplicates are ignored through the unique_attendance_record constraint
+    (ON CONFLICT DO NOTHING), so concurrent writers can't race each other.
+    Returns the number of rows actually inserted.
+    """
+    rows = list(dict.fromkeys(rows))
+    if not rows:
+        return 0
+
+    now = datetime.now(timezone.utc)
+    values = [{"session_id": session_id, "user_id": user_id, "timestamp": now} for session_id, user_id in rows]
+
+    dialect = db.session.get_bind().dialect.name
+    if dialect == "postgresql":
+        statement = postgresql_insert(AttendanceRecord).values(values).on_conflict_do_nothing(
+            constraint="unique_attendance_record"
+        )
+    elif dialect == "sqlite":
+        statement = sqlite_insert(AttendanceRecord).values(values).on_conflict_do_nothing()
+    else:
+        # No portable upsert; filter out existing pairs first
+        session_ids = {session_id for session_id, _ in rows}
+        existing = set(db.session.query(AttendanceRecord.session_id, AttendanceRecord.user_id).filter(
+            AttendanceRecord.session_id.in_(session_ids)
+        ).all())
+        values = [value for value in values if (value["session_id"], value["user_id"]) not in existing]
+        if not values:
+            return 0
+        statement = AttendanceRecord.__table__.insert().values(values)
+
+    inserted = db.session.execute(statement).rowcount
+    if commit:
+        db.session.commit()
+    return inserted
+
+
+def records_count_by_session(organization_id):
+    """Grouped count of attendance records per session of an organization, as a subquery.
+
+    Outer-join it on session_id to list sessions with their counts in one query. Counting at
+    read time means every writer (single marks, bulk inserts, cascading deletes) is covered.
+    """
+    return (
+        db.session.query(AttendanceRecord.session_id, func.count(AttendanceRecord.id).label("records_count"))
+        .join(AttendanceSession, AttendanceSession.id == AttendanceRecord.session_id)
+        .filter(AttendanceSession.organization_id == organization_id)
+        .group_by(AttendanceRecord.session_id)
+        .subquery()
+    )
+
+
+def sessions_with_records_count(organization_id):
+    # (AttendanceSession, records_count) rows of an organization
+    counts = records_count_by_session(organization_id)
+    return (
+        db.session.query(AttendanceSession, func.coalesce(counts.c.records_count, 0))
+        .outerjoin(counts, counts.c.session_id == AttendanceSession.id)
+        .filter(AttendanceSession.organization_id == organization_id)
+    )
+
+
+class AttendanceBuffer:
+    """Write-behind buffer for one session's recognized users, flushed on size or age."""
+
+    def __init__(self, session_id, max_size=ATTENDANCE_FLUSH_SIZE, max_age=ATTENDANCE_FLUSH_SECONDS):
+        self.session_id = session_id
+        self.max_size = max_size
+        self.max_age = max_age
+        self._pending = []
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self.flushes = 0
+        self.inserted = 0
+        self.failures = 0
+        self.last_batch_size = 0
+        self.last_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    def add(self, user_id):
+        with self._lock:
+            self._pending.append(user_id)
+
+    def __len__(self):
+        return len(self._pending)
+
+    def due(self):
+        return bool(self._pending) and (
+            len(self._pending) >= self.max_size or time.monotonic() - self._last_flush >= self.max_age
+        )
+
+    def maybe_flush(self):
+        return self.flush() if self.due() else 0
+
+    def flush(self):
+        with self._lock:
+            batch, self._pending = self._pending, []
+        self._last_flush = time.monotonic()
+        if not batch:
+            return 0
+
+        start = time.perf_counter()
+        try:
+            inserted = insert_attendance_records([(self.session_id, user_id) for user_id in batch])
+        except Exception:
+            # Keep the batch for the next attempt; duplicates are ignored on insert anyway
+            db.session.rollback()
+            with self._lock:
+                self._pending = batch + self._pending
+            self.failures += 1
+            raise
+
+        self.last_flush_ms = (time.perf_counter() - start) * 1e3
+        self.total_flush_ms += self.last_flush_ms
+        self.last_batch_size = len(batch)
+        self.flushes += 1
+        self.inserted += inserted
+        return inserted
+
+    def stats(self):
+        return {
+            "pending": len(self._pending),
+            "flushes": self.flushes,
+            "inserted": self.inserted,
+            "failures": self.failures,
+            "last_batch_size": self.last_batch_size,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+            "avg_flush_ms": round(self.total_flush_ms / self.flushes, 2) if self.flushes else 0.0,
+        }
@@ -0,0 +1,105 @@
+import heapq
+import itertools
+import threading
+import time
+
+# Returned by an enrollment job that should run again later (e.g. the image download failed)
+RETRY = "retry"
+
+
+class EnrollmentQueue:
+    """In-process queue of users whose face should be encoded, worked off by background threads.
+
+    job(user_pk, attempt, last_attempt) runs inside an app context and returns RETRY to be
+    rescheduled with exponential backoff, at most max_attempts times. Queuing a user that is
+    already waiting replaces the earlier entry, so a user is never encoded twice in a row.
+    """
+
+    def __init__(self, job, workers, max_attempts, retry_seconds, max_retry_seconds=300):
+        self.job = job
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_seconds = retry_seconds
+        self.max_retry_seconds = max_retry_seconds
+        self._heap = []  # (due, sequence, user_pk, attempt)
+        self._latest = {}  # user_pk -> sequence of its newest entry
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._threads = []
+        self._app = None
+        self.completed = 0
+        self.retries = 0
+        self.errors = 0
+
+    def put(self, app, user_ids):
+        with self._condition:
+            self._start(app)
+            for user_pk in user_ids:
+                self._push(time.monotonic(), user_pk, 1)
+            self._condition.notify_all()
+
+    def _push(self, due, user_pk, attempt):
+        sequence = next(self._sequence)
+        self._latest[user_pk] = sequence
+        heapq.heappush(self._heap, (due, sequence, user_pk, attempt))
+
+    def _start(self, app):
+        # Threads are started on first use, in whichever process (web or recognition worker) needs them
+        if self._threads:
+            return
+        self._app = app
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"face-enrollment-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _next_job(self):
+        with self._condition:
+            while True:
+                if self._heap:
+                    due, sequence, user_pk, attempt = self._heap[0]
+                    if self._latest.get(user_pk) != sequence:
+                        # Superseded by a newer entry for the same user
+                        heapq.heappop(self._heap)
+                        continue
+                    wait = due - time.monotonic()
+                    if wait <= 0:
+                        heapq.heappop(self._heap)
+                        del self._latest[user_pk]
+                        return user_pk, attempt
+                    self._condition.wait(wait)
+                else:
+                    self._condition.wait()
+
+    def _run(self):
+        while True:
+            user_pk, attempt = self._next_job()
+            last_attempt = attempt >= self.max_attempts
+            try:
+                with self._app.app_context():
+                    result = self.job(user_pk, attempt, last_attempt)
+            except Exception as e:
+                self.errors += 1
+                self._app.logger.error(f"Face enrollment of user {user_pk} failed: {e}")
+                continue
+
+            if result == RETRY and not last_attempt:
+                delay = min(self.retry_seconds * 2 ** (attempt - 1), self.max_retry_seconds)
+                with self._condition:
+                    # Unless the user was queued again in the meantime
+                    if user_pk not in self._latest:
+                        self._push(time.monotonic() + delay, user_pk, attempt + 1)
+                        self._condition.notify_all()
+                self.retries += 1
+            else:
+                self.completed += 1
+
+    def stats(self):
+        with self._condition:
+            return {
+                "workers": len(self._threads),
+                "queued": len(self._latest),
+                "completed": self.completed,
+                "retries": self.retries,
+                "errors": self.errors,
+            }
@@ -0,0 +1,105 @@
+import threading
+from collections import OrderedDict
+
+
+class FaceCache:
+    """LRU cache of KnownFaces per organization, bounded by the bytes its entries hold."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._dirty = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, organization_id):
+        with self._lock:
+            entry = self._entries.get(organization_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(organization_id)
+            self.hits += 1
+            return entry
+
+    def generation(self, organization_id):
+        # Read before building an entry and pass to put(), so an entry built while a change could
+        # not be recorded as dirty (see mark_dirty) is never stored
+        with self._lock:
+            return self._generations.get(organization_id, 0)
+
+    def put(self, organization_id, known_faces, generation=None):
+        with self._lock:
+            if generation is not None and generation != self._generations.get(organization_id, 0):
+                return False
+            # Replacing an entry keeps its dirty marks: they may be newer than what known_faces was built from
+            self._remove(organization_id, keep_dirty=True)
+            size = known_faces.nbytes
+            if size > self.max_bytes:
+                self._dirty.pop(organization_id, None)
+                return False
+            self._entries[organization_id] = known_faces
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                evicted_id, _ = next(iter(self._entries.items()))
+                self._remove(evicted_id)
+                self.evictions += 1
+            return True
+
+    def replace(self, organization_id, old, new):
+        # Swap an entry for the same faces held differently (e.g. read back from the face store),
+        # unless it changed meanwhile; its place in the LRU order and its dirty marks are kept
+        with self._lock:
+            if self._entries.get(organization_id) is not old:
+                return False
+            self._entries[organization_id] = new
+            self._bytes += new.nbytes - old.nbytes
+            return True
+
+    def mark_dirty(self, organization_id, user_ids):
+        # Users whose encodings changed; applied as a delta on the next load of the organization.
+        # Without an entry there is nothing to patch, but a full load may be running: bump the
+        # generation so its (possibly older) result isn't cached
+        with self._lock:
+            if organization_id in self._entries:
+                self._dirty.setdefault(organization_id, set()).update(user_ids)
+            else:
+                self._generations[organization_id] = self._generations.get(organization_id, 0) + 1
+
+    def take_dirty(self, organization_id):
+        with self._lock:
+            return self._dirty.pop(organization_id, set())
+
+    def clear(self):
+        with self._lock:
+            for organization_id in list(self._entries):
+                self._generations[organization_id] = self._generations.get(organization_id, 0) + 1
+            self._entries.clear()
+            self._dirty.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "organizations": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+    def _remove(self, organization_id, keep_dirty=False):
+        entry = self._entries.pop(organization_id, None)
+        if not keep_dirty:
+            self._dirty.pop(organization_id, None)
+        if entry is None:
+            return False
+        self._bytes -= entry.nbytes
+        return True
@@ -0,0 +1,157 @@
+import numpy as np
+from utils.face_quantization import QuantizedEncodings, as_float32
+
+# Organizations with at least this many encodings use the approximate index
+DEFAULT_ANN_THRESHOLD = 20000
+
+
+def _squared_distances(queries, matrix, matrix_sq_norms):
+    query_norms = np.einsum("ij,ij->i", queries, queries)
+    squared = query_norms[:, None] + matrix_sq_norms[None, :] - 2.0 * (queries @ matrix.T)
+    return np.maximum(squared, 0.0)
+
+
+def _top_k(squared, k):
+    # Indices of the k smallest values per row, sorted ascending
+    k = min(k, squared.shape[1])
+    if k < squared.shape[1]:
+        candidates = np.argpartition(squared, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.broadcast_to(np.arange(squared.shape[1]), squared.shape)
+    candidate_distances = np.take_along_axis(squared, candidates, axis=1)
+    order = np.argsort(candidate_distances, axis=1)
+    return (np.take_along_axis(candidates, order, axis=1),
+            np.sqrt(np.take_along_axis(candidate_distances, order, axis=1)))
+
+
+class ExactIndex:
+    """Brute-force scan over every encoding; one matrix product per batch of queries.
+
+    Compact (QuantizedEncodings) matrices are scanned block by block, dequantizing each block.
+    """
+
+    kind = "exact"
+
+    def __init__(self, matrix):
+        self.matrix = matrix
+        if isinstance(matrix, QuantizedEncodings):
+            self.sq_norms = matrix.sq_norms  # Owned and counted by the matrix
+        else:
+            self.sq_norms = np.einsum("ij,ij->i", matrix, matrix)
+
+    @property
+    def nbytes(self):
+        return 0 if isinstance(self.matrix, QuantizedEncodings) else self.sq_norms.nbytes
+
+    def search(self, queries, k):
+        if len(self.matrix) == 0:
+            empty = np.empty((len(queries), 0))
+            return empty.astype(np.intp), empty
+        if isinstance(self.matrix, QuantizedEncodings):
+            squared = np.concatenate([
+                _squared_distances(queries, block, self.sq_norms[start:start + len(block)])
+                for start, block in self.matrix.blocks()
+            ], axis=1)
+        else:
+            squared = _squared_distances(queries, self.matrix, self.sq_norms)
+        return _top_k(squared, k)
+
+
+class IVFIndex:
+    """Inverted-file index: k-means coarse clusters, only the n_probe nearest lists are scanned.
+
+    With offsets, the matrix is taken to be grouped by list already (rows offsets[i]:offsets[i + 1]
+    belong to centroid i, as the face store writes them) and is sliced instead of copied.
+    """
+
+    kind = "ivf"
+
+    def __init__(self, matrix, n_lists=None, n_probe=8, train_iterations=10, seed=0, centroids=None,
+                 offsets=None):
+        self.matrix = matrix
+        if centroids is not None:
+            # Reuse clusters from a previous build so small updates skip k-means training
+            self.centroids = centroids
+            self.n_lists = len(centroids)
+        else:
+            self.n_lists = n_lists or max(1, int(np.sqrt(len(matrix))))
+            self.centroids = self._train(as_float32(matrix), train_iterations, np.random.default_rng(seed))
+        self.n_probe = min(n_probe, self.n_lists)
+        self.centroid_sq_norms = np.einsum("ij,ij->i", self.centroids, self.centroids)
+
+        if offsets is not None:
+            # A shared memory-mapped matrix stays shared
+            self.order = np.arange(len(matrix))
+            self.offsets = np.asarray(offsets, dtype=np.intp)
+            self.grouped = matrix
+        else:
+            # Store vectors grouped by list so each probe is a contiguous slice; compact matrices stay compact
+            assignment = self._assign(as_float32(matrix))
+            self.order = np.argsort(assignment, kind="stable")
+            self.offsets = np.searchsorted(assignment[self.order], np.arange(self.n_lists + 1))
+            if isinstance(matrix, QuantizedEncodings):
+                self.grouped = matrix.subset(self.order)
+            else:
+                self.grouped = np.ascontiguousarray(matrix[self.order])
+        if isinstance(self.grouped, QuantizedEncodings):
+            self.grouped_sq_norms = self.grouped.sq_norms
+        else:
+            self.grouped_sq_norms = np.einsum("ij,ij->i", self.grouped, self.grouped)
+
+    @property
+    def nbytes(self):
+        sq_norms_bytes = 0 if isinstance(self.grouped, QuantizedEncodings) else self.grouped_sq_norms.nbytes
+        # A grouped matrix that is the matrix itself is counted by its owner
+        grouped_bytes = 0 if self.grouped is self.matrix else self.grouped.nbytes
+        return (self.centroids.nbytes + self.order.nbytes + self.offsets.nbytes
+                + grouped_bytes + sq_norms_bytes)
+
+    def _assign(self, vectors):
+        squared = _squared_distances(vectors, self.centroids, np.einsum("ij,ij->i", self.centroids, self.centroids))
+        return squared.argmin(axis=1)
+
+    def _train(self, matrix, iterations, rng):
+        # Plain Lloyd's k-means on a sample of the data
+        sample = matrix[rng.choice(len(matrix), size=min(len(matrix), self.n_lists * 64), replace=False)]
+        self.centroids = sample[rng.choice(len(sample), size=self.n_lists, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = self._assign(sample)
+            for index in range(self.n_lists):
+                members = sample[assignment == index]
+                if len(members):
+                    self.centroids[index] = members.mean(axis=0)
+        return self.centroids
+
+    def search(self, queries, k):
+        probes = _top_k(_squared_distances(queries, self.centroids, self.centroid_sq_norms), self.n_probe)[0]
+
+        indices = np.full((len(queries), k), -1, dtype=np.intp)
+        distances = np.full((len(queries), k), np.inf)
+        for row, lists in enumerate(probes):
+            candidates = np.concatenate([np.arange(self.offsets[i], self.offsets[i + 1]) for i in lists])
+            if len(candidates) == 0:
+                continue
+            if isinstance(self.grouped, QuantizedEncodings):
+                vectors = self.grouped.rows(candidates)
+            else:
+                vectors = self.grouped[candidates]
+            squared = _squared_distances(queries[row:row + 1], vectors, self.grouped_sq_norms[candidates])
+            top, top_distances = _top_k(squared, k)
+            indices[row, :top.shape[1]] = self.order[candidates[top[0]]]
+            distances[row, :top.shape[1]] = top_distances[0]
+        return indices, distances
+
+
+def build_index(matrix, kind="auto", ann_threshold=DEFAULT_ANN_THRESHOLD, previous=None, lists=None):
+    # Exact scans are faster and lossless until the organization gets very large.
+    # lists is the (centroids, offsets) of a matrix already grouped by list, as the face store keeps it
+    if kind == "auto":
+        kind = "ivf" if len(matrix) >= ann_threshold else "exact"
+    if kind == "ivf" and len(matrix) > 0:
+        if lists is not None:
+            centroids, offsets = lists
+            return IVFIndex(matrix, centroids=centroids, offsets=offsets)
+        if isinstance(previous, IVFIndex):
+            return IVFIndex(matrix, centroids=previous.centroids)
+        return IVFIndex(matrix)
+    return ExactIndex(matrix)
@@ -0,0 +1,97 @@
+import time
+import numpy as np
+from utils.face_index import DEFAULT_ANN_THRESHOLD, build_index
+from utils.face_quantization import as_float32, compact_encodings
+
+# Maximum euclidean distance for two encodings to be considered the same person
+MATCH_TOLERANCE = 0.4
+
+ENCODING_DIM = 128
+
+# Candidates fetched per face; enough to find the nearest other user when people have several encodings
+SEARCH_K = 8
+
+
+class KnownFaces:
+    """Known encodings of one organization as a contiguous float32 matrix with a parallel id array.
+
+    owners holds the User primary key of every row and versions maps each User primary key to the
+    version its rows were built from, so single users can be swapped in and out with updated().
+    With encoding_dtype "float16" or "int8" the matrix is kept compact (see face_quantization).
+    lists is the (centroids, offsets) of encodings already grouped by approximate index list.
+    """
+
+    def __init__(self, encodings, ids, owners=None, versions=None, index_kind="auto",
+                 ann_threshold=DEFAULT_ANN_THRESHOLD, previous_index=None, encoding_dtype="float32",
+                 lists=None):
+        self.encoding_dtype = encoding_dtype
+        self.matrix = compact_encodings(np.ascontiguousarray(
+            np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_DIM)
+        ), encoding_dtype)
+        self.ids = np.asarray(ids, dtype=object)
+        self.owners = np.asarray(owners if owners is not None else [], dtype=np.int64)
+        self.versions = dict(versions or {})
+        self.index_kind = index_kind
+        self.ann_threshold = ann_threshold
+        self.built_at = time.monotonic()
+        # Exact scan for small organizations, approximate index for very large ones
+        self.index = build_index(self.matrix, index_kind, ann_threshold, previous_index, lists)
+
+    def updated(self, changed_owners, encodings, ids, owners, versions):
+        """Return a copy where the rows of changed_owners are replaced by the given encodings."""
+        keep = ~np.isin(self.owners, np.fromiter(changed_owners, dtype=np.int64))
+        new_versions = {owner: version for owner, version in self.versions.items() if owner not in changed_owners}
+        new_versions.update(versions)
+        return KnownFaces(
+            np.concatenate([self.vectors()[keep], np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_DIM)]),
+            np.concatenate([self.ids[keep], np.asarray(ids, dtype=object)]),
+            np.concatenate([self.owners[keep], np.asarray(owners, dtype=np.int64)]),
+            new_versions,
+            self.index_kind,
+            self.ann_threshold,
+            previous_index=self.index,
+            encoding_dtype=self.encoding_dtype,
+        )
+
+    def vectors(self):
+        # The encodings as a float32 matrix (dequantized when stored compact)
+        return as_float32(self.matrix)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def nbytes(self):
+        return self.matrix.nbytes + self.ids.nbytes + self.owners.nbytes + self.index.nbytes
+
+    def match(self, face_encodings, tolerance=MATCH_TOLERANCE):
+        """Match every face of a frame at once.
+
+        Returns one (user_id or None, distance, margin) tuple per face, where margin is how much
+        closer the best match is than the nearest encoding of any other user.
+        """
+        if len(face_encodings) == 0:
+            return []
+        if len(self) == 0:
+            return [(None, float("inf"), 0.0) for _ in face_encodings]
+
+        queries = np.asarray(face_encodings, dtype=np.float32).reshape(-1, ENCODING_DIM)
+        candidates, distances = self.index.search(queries, SEARCH_K)
+
+        results = []
+        for row_candidates, row_distances in zip(candidates, distances):
+            if len(row_candidates) == 0 or row_candidates[0] < 0:
+                results.append((None, float("inf"), 0.0))
+                continue
+            best_id = self.ids[row_candidates[0]]
+            distance = float(row_distances[0])
+
+            # Nearest candidate that belongs to a different user
+            margin = float("inf")
+            for candidate, candidate_distance in zip(row_candidates[1:], row_distances[1:]):
+                if candidate >= 0 and self.ids[candidate] != best_id:
+                    margin = float(candidate_distance) - distance
+                    break
+
+            results.append((best_id if distance < tolerance else None, distance, margin))
+        return results
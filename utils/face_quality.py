@@ -0,0 +1,85 @@
+import threading
+import cv2
+import face_recognition
+import numpy as np
+
+from config import FACE_MIN_SIZE, FACE_MIN_SHARPNESS, FACE_MAX_YAW
+
+# Face crops are resized to this before the blur score so it doesn't depend on face size
+SHARPNESS_CROP_SIZE = 96
+
+REJECTION_RULES = ("too_small", "blurry", "pose")
+
+
+def sharpness(gray_image, location):
+    # Variance of the Laplacian over the face crop; low values mean few edges, i.e. a blurred face
+    top, right, bottom, left = location
+    crop = gray_image[max(0, top):bottom, max(0, left):right]
+    if crop.size == 0:
+        return 0.0
+    crop = cv2.resize(crop, (SHARPNESS_CROP_SIZE, SHARPNESS_CROP_SIZE), interpolation=cv2.INTER_AREA)
+    return float(cv2.Laplacian(crop, cv2.CV_64F).var())
+
+
+def yaw(landmarks):
+    # Horizontal offset of the nose tip from the midpoint between the eyes, relative to eye distance:
+    # about 0 for a frontal face and approaching 0.5 or more in profile
+    left_eye = np.mean(landmarks["left_eye"], axis=0)
+    right_eye = np.mean(landmarks["right_eye"], axis=0)
+    nose = np.mean(landmarks["nose_tip"], axis=0)
+    eye_distance = np.linalg.norm(right_eye - left_eye)
+    if eye_distance == 0:
+        return float("inf")
+    return float(abs(nose[0] - (left_eye[0] + right_eye[0]) / 2) / eye_distance)
+
+
+class FaceQualityGate:
+    """Drops detections that are too small, blurred or turned away before they reach dlib's encoder.
+
+    Each rule is skipped when its threshold is 0. Rejections are counted under the first rule a
+    face fails; gates in encoder processes report their counts back through merge().
+    """
+
+    def __init__(self, min_size=FACE_MIN_SIZE, min_sharpness=FACE_MIN_SHARPNESS, max_yaw=FACE_MAX_YAW):
+        self.min_size = min_size
+        self.min_sharpness = min_sharpness
+        self.max_yaw = max_yaw
+        self.counts = dict.fromkeys(("checked", "passed") + REJECTION_RULES, 0)
+        self._lock = threading.Lock()
+
+    def filter(self, image, locations):
+        """Return the locations worth encoding; image is the RGB array they were found in."""
+        rejected = dict.fromkeys(REJECTION_RULES, 0)
+        kept = []
+        gray = None
+        for location in locations:
+            top, right, bottom, left = location
+            if self.min_size and min(bottom - top, right - left) < self.min_size:
+                rejected["too_small"] += 1
+                continue
+            if self.min_sharpness:
+                if gray is None:
+                    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+                if sharpness(gray, location) < self.min_sharpness:
+                    rejected["blurry"] += 1
+                    continue
+            kept.append(location)
+
+        # Landmarks cost a shape prediction per face, so they only run on faces that passed so far
+        if self.max_yaw and kept:
+            landmarks = face_recognition.face_landmarks(image, kept, model="small")
+            frontal = [location for location, points in zip(kept, landmarks) if yaw(points) <= self.max_yaw]
+            rejected["pose"] += len(kept) - len(frontal)
+            kept = frontal
+
+        self.merge(dict(rejected, checked=len(locations), passed=len(kept)))
+        return kept
+
+    def merge(self, counts):
+        with self._lock:
+            for rule, count in counts.items():
+                self.counts[rule] = self.counts.get(rule, 0) + count
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts)
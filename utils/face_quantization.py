@@ -0,0 +1,85 @@
+import numpy as np
+
+# Supported compact encodings; float32 keeps the plain matrix
+ENCODING_DTYPES = ("float32", "float16", "int8")
+
+# Rows dequantized at a time while scanning, so the float32 copy stays small
+BLOCK_ROWS = 8192
+
+
+class QuantizedEncodings:
+    """Face encodings stored as float16 or int8 codes, dequantized to float32 only while scanned.
+
+    int8 codes use one scale per row (largest absolute value / 127), so every row keeps its full
+    code range. Squared norms are taken from the dequantized vectors, which keeps the distance
+    expansion in face_index consistent with the values actually compared.
+    """
+
+    def __init__(self, codes, scales, sq_norms):
+        self.codes = codes
+        self.scales = scales  # None for float16
+        self.sq_norms = sq_norms
+
+    @classmethod
+    def from_matrix(cls, matrix, dtype):
+        matrix = np.asarray(matrix, dtype=np.float32)
+        if dtype == "float16":
+            codes, scales = matrix.astype(np.float16), None
+        elif dtype == "int8":
+            scales = np.abs(matrix).max(axis=1) / 127.0 if len(matrix) else np.empty(0, dtype=np.float32)
+            scales = np.where(scales > 0, scales, 1.0).astype(np.float32)
+            codes = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+        else:
+            raise ValueError(f"Unsupported encoding dtype: {dtype}")
+        encodings = cls(np.ascontiguousarray(codes), scales, None)
+        dequantized = encodings.dequantize()
+        encodings.sq_norms = np.einsum("ij,ij->i", dequantized, dequantized)
+        return encodings
+
+    @property
+    def dtype(self):
+        return "float16" if self.scales is None else "int8"
+
+    @property
+    def shape(self):
+        return self.codes.shape
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + self.sq_norms.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def rows(self, indices):
+        # float32 copies of the given rows (an index array, boolean mask or slice)
+        vectors = self.codes[indices].astype(np.float32)
+        if self.scales is not None:
+            vectors *= self.scales[indices][:, None]
+        return vectors
+
+    def subset(self, indices):
+        # The given rows, still compact
+        return QuantizedEncodings(
+            np.ascontiguousarray(self.codes[indices]),
+            self.scales[indices] if self.scales is not None else None,
+            self.sq_norms[indices],
+        )
+
+    def blocks(self, block_rows=BLOCK_ROWS):
+        for start in range(0, len(self), block_rows):
+            yield start, self.rows(slice(start, start + block_rows))
+
+    def dequantize(self):
+        return self.rows(slice(None))
+
+
+def compact_encodings(matrix, dtype):
+    # The matrix itself for float32, a QuantizedEncodings otherwise
+    if dtype == "float32":
+        return matrix
+    return QuantizedEncodings.from_matrix(matrix, dtype)
+
+
+def as_float32(matrix):
+    return matrix.dequantize() if isinstance(matrix, QuantizedEncodings) else matrix
@@ -0,0 +1,236 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import numpy as np
+
+from utils.face_index import IVFIndex
+from utils.face_matching import ENCODING_DIM, KnownFaces
+
+# Bump when the on-disk layout changes so old files are ignored
+STORE_FORMAT = 2
+
+# Replaced matrix files younger than this are left alone: another process may be about to publish one
+STALE_MATRIX_SECONDS = 60
+
+
+class FaceStore:
+    """Known faces per organization on disk, shared by every worker process through the page cache.
+
+    Each organization has a raw float32 matrix file (rows of ENCODING_DIM values, no header) opened
+    with numpy.memmap, and a JSON index naming that file with the ids, owners and versions of its
+    rows. A new matrix gets a new file name and the index is swapped in with os.replace last, so
+    readers always see a complete pair; mappings of replaced files stay valid until dropped.
+    Organizations with an approximate index are written in list order with the list centroids
+    after the rows, so the loaded index slices the mapping instead of copying it.
+
+    Writes rewrite the whole organization, so callers on the request path use save_later(): a
+    background thread writes the newest KnownFaces of each organization at most once every
+    write_interval seconds and then calls on_write(organization_id, written, mapped) with the
+    same faces read back from the new file. A store that lags behind is harmless, since loads
+    diff it against the per-user versions in the database.
+    """
+
+    def __init__(self, directory, model_version, write_interval=0, on_write=None):
+        self.directory = directory
+        self.model_version = model_version
+        self.write_interval = write_interval
+        self.on_write = on_write
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()  # Held while files are written or deleted
+        self._pending = {}  # organization_id -> newest KnownFaces not written yet
+        self._last_write = {}  # organization_id -> time.monotonic() of its last write
+        self._wakeup = threading.Condition(self._lock)
+        self._writer = None
+        self.loads = 0
+        self.misses = 0
+        self.writes = 0
+        self.write_errors = 0
+        self.last_write_ms = 0.0
+
+    @property
+    def enabled(self):
+        return bool(self.directory)
+
+    def _index_path(self, organization_id):
+        return os.path.join(self.directory, f"org_{organization_id}.json")
+
+    def load(self, organization_id, index_kind, ann_threshold, encoding_dtype="float32"):
+        # KnownFaces backed by the memory-mapped matrix, or None when nothing usable is stored
+        if not self.enabled:
+            return None
+        try:
+            with open(self._index_path(organization_id)) as index_file:
+                index = json.load(index_file)
+            if index.get("format") != STORE_FORMAT or index.get("model_version") != self.model_version:
+                raise ValueError("stale face store")
+            known_faces = self._open(index, index_kind, ann_threshold, encoding_dtype)
+        except (OSError, ValueError, KeyError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.loads += 1
+        return known_faces
+
+    def _open(self, index, index_kind, ann_threshold, encoding_dtype):
+        rows, offsets = index["rows"], index["offsets"]
+        lists = None
+        if rows:
+            stored = np.memmap(os.path.join(self.directory, index["matrix"]), dtype=np.float32,
+                               mode="r", shape=(rows + max(len(offsets) - 1, 0), ENCODING_DIM))
+            matrix = stored[:rows]
+            if offsets:
+                lists = (np.array(stored[rows:]), offsets)
+        else:
+            matrix = np.empty((0, ENCODING_DIM), dtype=np.float32)
+
+        versions = {int(owner): tuple(version) for owner, version in index["versions"].items()}
+        # Compact dtypes copy the rows into process memory; float32 keeps reading the shared mapping
+        return KnownFaces(matrix, index["ids"], index["owners"], versions, index_kind, ann_threshold,
+                          encoding_dtype=encoding_dtype, lists=lists)
+
+    def save_later(self, organization_id, known_faces):
+        # Replaces any write of the organization still waiting; returns immediately
+        if not self.enabled:
+            return
+        with self._lock:
+            self._pending[organization_id] = known_faces
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_pending, name="face-store-writer", daemon=True)
+                self._writer.start()
+            self._wakeup.notify()
+
+    def _write_pending(self):
+        while True:
+            with self._lock:
+                while True:
+                    now = time.monotonic()
+                    due = {organization_id: self._last_write.get(organization_id, float("-inf")) + self.write_interval
+                           for organization_id in self._pending}
+                    ready = [organization_id for organization_id, at in due.items() if at <= now]
+                    if ready:
+                        break
+                    self._wakeup.wait(timeout=min(due.values()) - now if due else None)
+                organization_id = ready[0]
+                known_faces = self._pending.pop(organization_id)
+                self._last_write[organization_id] = now
+            with self._write_lock:
+                with self._lock:
+                    # delete() ran since the write was taken from the queue
+                    if organization_id not in self._last_write:
+                        continue
+                try:
+                    index = self._save(organization_id, known_faces)
+                except OSError:
+                    with self._lock:
+                        self.write_errors += 1
+                    continue
+            # Compact dtypes are copied into process memory either way, so only float32 is worth remapping
+            if self.on_write is not None and known_faces.encoding_dtype == "float32":
+                try:
+                    mapped = self._open(index, known_faces.index_kind, known_faces.ann_threshold, "float32")
+                except (OSError, ValueError):
+                    continue
+                mapped.built_at = known_faces.built_at
+                self.on_write(organization_id, known_faces, mapped)
+
+    def save(self, organization_id, known_faces):
+        if not self.enabled:
+            return False
+        with self._write_lock:
+            self._save(organization_id, known_faces)
+        return True
+
+    def _save(self, organization_id, known_faces):
+        # Writes the organization and returns its new JSON index
+        start = time.perf_counter()
+        os.makedirs(self.directory, exist_ok=True)
+
+        vectors, ids, owners = known_faces.vectors(), known_faces.ids, known_faces.owners
+        centroids, offsets = np.empty((0, ENCODING_DIM), dtype=np.float32), []
+        if isinstance(known_faces.index, IVFIndex):
+            # In list order, with the centroids after the rows and the list boundaries in the JSON index
+            ivf = known_faces.index
+            vectors, ids, owners = vectors[ivf.order], ids[ivf.order], owners[ivf.order]
+            centroids, offsets = ivf.centroids, [int(offset) for offset in ivf.offsets]
+
+        matrix_name = f"org_{organization_id}.{time.time_ns()}.{os.getpid()}.f32"
+        self._write_atomic(matrix_name, np.ascontiguousarray(vectors, dtype=np.float32).tobytes(),
+                           np.ascontiguousarray(centroids, dtype=np.float32).tobytes())
+        index = {
+            "format": STORE_FORMAT,
+            "model_version": self.model_version,
+            "matrix": matrix_name,
+            "rows": len(ids),
+            "offsets": offsets,
+            "ids": [str(id) for id in ids],
+            "owners": [int(owner) for owner in owners],
+            "versions": {str(owner): list(version) for owner, version in known_faces.versions.items()},
+        }
+        self._write_atomic(os.path.basename(self._index_path(organization_id)), json.dumps(index).encode())
+        self._remove_old_matrices(organization_id, keep=matrix_name, min_age=STALE_MATRIX_SECONDS)
+
+        with self._lock:
+            self.writes += 1
+            self.last_write_ms = (time.perf_counter() - start) * 1e3
+        return index
+
+    def delete(self, organization_id):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._pending.pop(organization_id, None)
+            self._last_write.pop(organization_id, None)
+        # Waits for a write of the organization that is already under way
+        with self._write_lock:
+            try:
+                os.remove(self._index_path(organization_id))
+            except FileNotFoundError:
+                pass
+            if os.path.isdir(self.directory):
+                self._remove_old_matrices(organization_id)
+
+    def _write_atomic(self, name, *chunks):
+        # Write next to the target and rename, so a crash never leaves a half-written file behind
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as tmp_file:
+                for data in chunks:
+                    tmp_file.write(data)
+                tmp_file.flush()
+                os.fsync(tmp_file.fileno())
+            os.replace(tmp_path, os.path.join(self.directory, name))
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+    def _remove_old_matrices(self, organization_id, keep=None, min_age=0):
+        # Other processes may still map these; unlinking only frees the space once they let go
+        prefix = f"org_{organization_id}."
+        now = time.time()
+        for name in os.listdir(self.directory):
+            if not name.startswith(prefix) or not name.endswith(".f32") or name == keep:
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                if now - os.path.getmtime(path) >= min_age:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "directory": self.directory,
+                "loads": self.loads,
+                "misses": self.misses,
+                "writes": self.writes,
+                "pending_writes": len(self._pending),
+                "write_errors": self.write_errors,
+                "last_write_ms": round(self.last_write_ms, 2),
+            }
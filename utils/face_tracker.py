@@ -0,0 +1,95 @@
+import itertools
+
+# Minimum overlap for a detection to continue an existing track
+IOU_THRESHOLD = 0.3
+# Detection rounds a track may go unseen before it is dropped (and re-encoded if it comes back)
+MAX_MISSES = 2
+
+
+def box_iou(a, b):
+    # Boxes are face_recognition (top, right, bottom, left) tuples
+    top, bottom = max(a[0], b[0]), min(a[2], b[2])
+    left, right = max(a[3], b[3]), min(a[1], b[1])
+    if bottom <= top or right <= left:
+        return 0.0
+    intersection = (bottom - top) * (right - left)
+    area_a = (a[2] - a[0]) * (a[1] - a[3])
+    area_b = (b[2] - b[0]) * (b[1] - b[3])
+    return intersection / float(area_a + area_b - intersection)
+
+
+class Track:
+    def __init__(self, track_id, location):
+        self.id = track_id
+        self.location = location
+        self.user_id = None  # Set once the face has been identified
+        self.name = "Unknown"
+        self.misses = 0
+
+    @property
+    def identified(self):
+        return self.user_id is not None
+
+
+class FaceTracker:
+    """Associates face boxes between detection rounds by IoU so identified faces aren't re-encoded."""
+
+    def __init__(self, iou_threshold=IOU_THRESHOLD, max_misses=MAX_MISSES):
+        self.iou_threshold = iou_threshold
+        self.max_misses = max_misses
+        self.tracks = []
+        self._ids = itertools.count(1)
+        self.encodings_skipped = 0
+        self.encodings_needed = 0
+
+    def update(self, locations):
+        """Return one Track per location, continuing existing tracks where boxes overlap."""
+        pairs = sorted(
+            ((box_iou(track.location, location), t, l)
+             for t, track in enumerate(self.tracks) for l, location in enumerate(locations)),
+            reverse=True,
+        )
+
+        # Greedy association, best overlaps first
+        assigned = [None] * len(locations)
+        used_tracks = set()
+        for iou, t, l in pairs:
+            if iou < self.iou_threshold:
+                break
+            if t in used_tracks or assigned[l] is not None:
+                continue
+            assigned[l] = self.tracks[t]
+            used_tracks.add(t)
+
+        kept = []
+        for t, track in enumerate(self.tracks):
+            if t not in used_tracks:
+                track.misses += 1
+                if track.misses > self.max_misses:
+                    continue
+            kept.append(track)
+
+        for l, location in enumerate(locations):
+            track = assigned[l]
+            if track is None:
+                track = Track(next(self._ids), location)
+                kept.append(track)
+            track.location = location
+            track.misses = 0
+            assigned[l] = track
+
+        self.tracks = kept
+        for track in assigned:
+            if track.identified:
+                self.encodings_skipped += 1
+            else:
+                self.encodings_needed += 1
+        return assigned
+
+    def stats(self):
+        return {
+            "tracks": len(self.tracks),
+            "identified": sum(1 for track in self.tracks if track.identified),
+            "encodings_needed": self.encodings_needed,
+            "encodings_skipped": self.encodings_skipped,
+        }
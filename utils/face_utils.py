@@ -1,65 +1,552 @@
+import hashlib
+import multiprocessing
+import time
+import cv2
 import requests
 import face_recognition
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from io import BytesIO
 from PIL import Image
-from models import User
-from config import db
+from requests.adapters import HTTPAdapter
+from flask import current_app
+from sqlalchemy import and_, event, inspect
+from sqlalchemy.orm import Session, joinedload
+from models import FaceEmbedding, FaceEnrollment, Organization, User
+from config import (db, FACE_DOWNLOAD_WORKERS, FACE_ENCODE_WORKERS, FACE_INDEX_KIND, FACE_ANN_THRESHOLD,
+                    FACE_ENCODING_DTYPE,
+                    FACE_CACHE_MAX_BYTES, FACE_CACHE_REVALIDATE_SECONDS, FACE_STORE_DIR,
+                    FACE_STORE_WRITE_SECONDS,
+                    IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_BYTES, FACE_DETECT_MAX_DIMENSION,
+                    ENROLLMENT_WORKERS, ENROLLMENT_MAX_ATTEMPTS, ENROLLMENT_RETRY_SECONDS)
+from utils.enrollment_queue import RETRY, EnrollmentQueue
+from utils.face_cache import FaceCache
+from utils.face_matching import KnownFaces
+from utils.face_quality import REJECTION_RULES, FaceQualityGate
+from utils.face_store import FaceStore
+from utils.image_cache import ImageCache
+from utils.recognition_utils import detect_faces
 
-# Dictionary cache to store known faces per organization
-known_faces_cache = {}
+# Bump this whenever the encoding model changes so stored embeddings get recomputed
+FACE_MODEL_VERSION = "dlib_face_recognition_resnet_model_v1"
 
-def load_known_faces(organization_id, force_reload=False):
-    global known_faces_cache
+# Known faces per organization, LRU-evicted once FACE_CACHE_MAX_BYTES is exceeded
+known_faces_cache = FaceCache(FACE_CACHE_MAX_BYTES)
 
-    # Check cache for the organization
-    if not force_reload and organization_id in known_faces_cache:
-        return known_faces_cache[organization_id]
+# Memory-mapped copy of known faces on disk, shared by every worker process on this host. Once an
+# organization is written, its cache entry switches from this process' copy to the shared mapping
+face_store = FaceStore(FACE_STORE_DIR, FACE_MODEL_VERSION, FACE_STORE_WRITE_SECONDS,
+                       on_write=known_faces_cache.replace)
 
-    known_face_encodings, known_face_names = [], []
+# Rejection counts of the face quality prefilter, across enrollment and recognition in this process
+face_quality = FaceQualityGate()
 
-    # Fetch users with images from the specific organization
-    users = db.session.query(User.user_id, User.image_url).filter(
-        User.image_url.isnot(None),
-        User.organization_id == organization_id
-    ).all()
+# Downloaded profile images, revalidated instead of re-downloaded when unchanged
+image_cache = ImageCache(IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_BYTES)
 
-    for user_id, image_url in users:
-        try:
-            response = requests.get(image_url, timeout=10)
-            response.raise_for_status()
+# Shared HTTP session (keep-alive connection pool) and encoder process pool, created lazily
+_http_session = None
+_encode_pool = None
+_encode_workers = FACE_ENCODE_WORKERS
+
+
+def get_http_session():
+    global _http_session
+    if _http_session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=FACE_DOWNLOAD_WORKERS, pool_maxsize=FACE_DOWNLOAD_WORKERS)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _http_session = session
+    return _http_session
+
+
+def get_encode_pool():
+    global _encode_pool
+    if _encode_pool is None and _encode_workers > 1:
+        # Spawned rather than forked: a fork of a web process would copy its threads' locks and open connections
+        _encode_pool = ProcessPoolExecutor(max_workers=_encode_workers, mp_context=multiprocessing.get_context("spawn"))
+    return _encode_pool
+
+
+def set_encode_workers(workers):
+    # Recognition worker processes run one per camera and size their own pool (see recognition_supervisor)
+    global _encode_workers
+    _encode_workers = workers
+
+
+def fetch_image(image_url):
+    return image_cache.fetch(get_http_session(), image_url, timeout=10)
+
+
+def load_rgb_image(image_bytes):
+    # Decode the downloaded bytes straight into an RGB array (raises OSError for unidentified formats)
+    image = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is not None:
+        return cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=image)
+
+    # Formats OpenCV can't read (e.g. GIF)
+    image = Image.open(BytesIO(image_bytes))
+    return np.array(image.convert("RGB"))
+
+
+def locate_faces(image, max_dimension=FACE_DETECT_MAX_DIMENSION):
+    # HOG detection cost grows with pixel count, so large photos are detected on a capped copy
+    longest_side = max(image.shape[:2])
+    scale = max_dimension / longest_side if max_dimension and longest_side > max_dimension else 1.0
+    return detect_faces(image, scale)
+
+
+def encode_image_bytes(image_bytes, quality_gate=None):
+    # Process image for face recognition: one decode, detection on a capped copy, encoding at full size
+    image = load_rgb_image(image_bytes)
+    locations = (quality_gate or face_quality).filter(image, locate_faces(image))
+    return face_recognition.face_encodings(image, locations)
+
+
+def _encode_job(image_bytes):
+    # Runs in the encoder process pool; returns (status, encodings, seconds, quality counts)
+    start = time.perf_counter()
+    quality_gate = FaceQualityGate()
+    try:
+        encodings = encode_image_bytes(image_bytes, quality_gate)
+        status = "ok" if encodings else "no_face"
+    except OSError:
+        encodings, status = [], "bad_image"
+    except Exception:
+        encodings, status = [], "failed"
+    return status, encodings, time.perf_counter() - start, quality_gate.stats()
+
+
+def _detect_job(image_bytes):
+    # Runs in the encoder process pool; returns (status, locations, encodings, seconds, quality counts)
+    start = time.perf_counter()
+    quality_gate = FaceQualityGate()
+    try:
+        image = load_rgb_image(image_bytes)
+        locations = quality_gate.filter(image, locate_faces(image))
+        encodings = face_recognition.face_encodings(image, locations)
+        status = "ok" if encodings else "no_face"
+    except OSError:
+        locations, encodings, status = [], [], "bad_image"
+    except Exception:
+        locations, encodings, status = [], [], "failed"
+    return status, locations, encodings, time.perf_counter() - start, quality_gate.stats()
+
+
+def run_in_encode_pool(function, *args):
+    # Offload CPU-bound dlib work so the calling thread doesn't hold the GIL while it runs
+    encode_pool = get_encode_pool()
+    if encode_pool is None:
+        return function(*args)
+    return encode_pool.submit(function, *args).result()
 
-            # Open and validate image
+
+def encode_faces(image, locations):
+    # Encode several faces of one image, split across the encoder processes when it pays off
+    encode_pool = get_encode_pool()
+    if encode_pool is None or len(locations) < 2:
+        return run_in_encode_pool(face_recognition.face_encodings, image, locations)
+    chunk_count = min(_encode_workers, len(locations))
+    chunks = [locations[i::chunk_count] for i in range(chunk_count)]
+    results = list(encode_pool.map(face_recognition.face_encodings, [image] * chunk_count, chunks))
+    # Undo the round-robin split so encodings line up with locations
+    encodings = [None] * len(locations)
+    for i, chunk_encodings in enumerate(results):
+        encodings[i::chunk_count] = chunk_encodings
+    return encodings
+
+
+def detect_and_encode_images(images):
+    # Detect and encode every face of each uploaded image, spread across the encoder process pool;
+    # returns (status, locations, encodings, seconds) per image
+    encode_pool = get_encode_pool()
+    if encode_pool is None or len(images) == 1:
+        results = [_detect_job(image_bytes) for image_bytes in images]
+    else:
+        results = list(encode_pool.map(_detect_job, images))
+    for *_, quality_counts in results:
+        face_quality.merge(quality_counts)
+    return [result[:4] for result in results]
+
+
+def _download_job(image_url):
+    start = time.perf_counter()
+    image_bytes = fetch_image(image_url)
+    return image_bytes, time.perf_counter() - start
+
+
+def encode_user_images(users):
+    """Download and encode images for (id, image_url) pairs in parallel.
+
+    Downloads share one pooled HTTP session with at most FACE_DOWNLOAD_WORKERS requests
+    in flight; each finished download is handed straight to the encoder process pool.
+    Returns ({id: (status, image_hash, encodings, error)}, stats) with an entry for every id;
+    encodings are only meaningful for "ok" and "no_face".
+    """
+    start = time.perf_counter()
+    stats = {
+        "users": len(users),
+        "download": {"ok": 0, "failed": 0, "seconds": 0.0},
+        "encode": {"ok": 0, "no_face": 0, "bad_image": 0, "failed": 0, "seconds": 0.0},
+        "quality": {},
+        "total_seconds": 0.0,
+    }
+    results = {}
+    encoded = {}
+    if not users:
+        return encoded, stats
+
+    encode_pool = get_encode_pool()
+    encode_futures = {}
+
+    with ThreadPoolExecutor(max_workers=FACE_DOWNLOAD_WORKERS) as download_pool:
+        download_futures = {download_pool.submit(_download_job, image_url): id for id, image_url in users}
+        for future in as_completed(download_futures):
+            id = download_futures[future]
             try:
-                image = Image.open(BytesIO(response.content))
-            except OSError:
-                print(f"[Warning] Skipping {user_id}: Unidentified image format.")
+                image_bytes, seconds = future.result()
+            except requests.exceptions.RequestException as e:
+                stats["download"]["failed"] += 1
+                encoded[id] = ("failed", None, [], str(e)[:255])
                 continue
+            stats["download"]["ok"] += 1
+            stats["download"]["seconds"] += seconds
 
-            # Convert non-JPEG/PNG images to RGB
-            if image.format not in ["JPEG", "PNG"]:
-                image = image.convert("RGB")
+            image_hash = hashlib.sha256(image_bytes).hexdigest()
+            if encode_pool is not None:
+                encode_futures[encode_pool.submit(_encode_job, image_bytes)] = (id, image_hash)
+            else:
+                results[id] = (image_hash, _encode_job(image_bytes))
 
-            # Convert image to bytes buffer for processing
-            buffer = BytesIO()
-            image.save(buffer, format="JPEG")
-            buffer.seek(0)
+    for future in as_completed(encode_futures):
+        id, image_hash = encode_futures[future]
+        try:
+            results[id] = (image_hash, future.result())
+        except Exception:
+            # The worker process died (e.g. dlib crashed on a corrupt image)
+            results[id] = (image_hash, ("failed", [], 0.0, {}))
 
-            # Process image for face recognition
-            face_image = face_recognition.load_image_file(buffer)
-            face_encodings = face_recognition.face_encodings(face_image)
+    for id, (image_hash, (status, encodings, seconds, quality_counts)) in results.items():
+        stats["encode"][status] += 1
+        stats["encode"]["seconds"] += seconds
+        face_quality.merge(quality_counts)
+        for rule, count in quality_counts.items():
+            stats["quality"][rule] = stats["quality"].get(rule, 0) + count
+        encoded[id] = (status, image_hash, encodings, _enrollment_error(status, quality_counts))
 
-            if face_encodings:
-                for encoding in face_encodings:
-                    known_face_encodings.append(encoding)
-                    known_face_names.append(user_id)
-            else:
-                print(f"[Warning] No face detected for {user_id}")
+    stats["total_seconds"] = time.perf_counter() - start
+    return encoded, stats
+
+
+def save_face_embeddings(user, image_hash, encodings, invalidate=True):
+    # Replace whatever was stored for this user with the new encodings
+    if invalidate:
+        _mark_stale(db.session, user.organization_id, user.id)
+    FaceEmbedding.query.filter_by(user_id=user.id).delete()
+    for encoding in encodings:
+        db.session.add(FaceEmbedding(
+            user_id=user.id,
+            encoding=np.asarray(encoding, dtype=np.float64).tobytes(),
+            image_url=user.image_url,
+            image_hash=image_hash,
+            model_version=FACE_MODEL_VERSION
+        ))
+
+
+def _enrollment_error(status, quality_counts):
+    # What GET /users/<id>/enrollment shows besides the status, e.g. "rejected: blurry"
+    if status in ("ok", "no_face"):
+        rejected = [rule for rule in REJECTION_RULES if quality_counts.get(rule)]
+        return "rejected: " + ", ".join(rejected) if status == "no_face" and rejected else None
+    return status
+
+
+def _set_enrollment(user, status, error, attempts):
+    enrollment = user.face_enrollment
+    if enrollment is None:
+        enrollment = user.face_enrollment = FaceEnrollment()
+    enrollment.image_url = user.image_url
+    enrollment.status, enrollment.error, enrollment.attempts = status, error, attempts
+    return enrollment
+
+
+def enroll_users(users, invalidate=True):
+    # Encode a batch of User objects through the parallel pipeline and persist embeddings and enrollment status
+    encoded, stats = encode_user_images([(user.id, user.image_url) for user in users])
+    for user in users:
+        status, image_hash, encodings, error = encoded[user.id]
+        if status in ("ok", "no_face"):
+            save_face_embeddings(user, image_hash, encodings, invalidate)
+        attempts = user.face_enrollment.attempts + 1 if user.face_enrollment else 1
+        _set_enrollment(user, status if status in ("ok", "no_face") else "failed", error, attempts)
+    db.session.commit()
+    return encoded, stats
+
+
+def _enrollment_job(user_pk, attempt, last_attempt):
+    # Runs on an enrollment queue thread; returns RETRY when the download should be tried again
+    user = db.session.get(User, user_pk)
+    if user is None:
+        return None
+    if not user.image_url:
+        _mark_stale(db.session, user.organization_id, user.id)
+        FaceEmbedding.query.filter_by(user_id=user.id).delete()
+        if user.face_enrollment is not None:
+            db.session.delete(user.face_enrollment)
+        db.session.commit()
+        return None
+
+    try:
+        image_bytes = fetch_image(user.image_url)
+    except requests.exceptions.RequestException as e:
+        _set_enrollment(user, "failed" if last_attempt else "pending", str(e)[:255], attempt)
+        db.session.commit()
+        return RETRY
+
+    status, encodings, _, quality_counts = run_in_encode_pool(_encode_job, image_bytes)
+    face_quality.merge(quality_counts)
+    if status in ("ok", "no_face"):
+        save_face_embeddings(user, hashlib.sha256(image_bytes).hexdigest(), encodings)
+    _set_enrollment(user, status if status in ("ok", "no_face") else "failed",
+                    _enrollment_error(status, quality_counts), attempt)
+    db.session.commit()
+    return None
+
+
+# Background enrollment, started in whichever process first schedules a user
+enrollment_queue = EnrollmentQueue(_enrollment_job, ENROLLMENT_WORKERS, ENROLLMENT_MAX_ATTEMPTS,
+                                   ENROLLMENT_RETRY_SECONDS)
+
+
+def schedule_enrollment(users):
+    # Mark users' enrollment pending; they're queued for encoding once the transaction commits
+    for user in users:
+        if not user.image_url:
+            continue
+        if user.face_enrollment is None:
+            user.face_enrollment = FaceEnrollment()
+        user.face_enrollment.image_url = user.image_url
+        user.face_enrollment.status = "pending"
+        user.face_enrollment.attempts = 0
+        user.face_enrollment.error = None
+        db.session.info.setdefault("enroll_face_users", []).append(user)
+
+
+def _stored_embeddings(organization_id, user_ids=None):
+    # One query for every user with an image, joined to embeddings that are still current and to
+    # the enrollment status of the current image
+    query = db.session.query(
+        User.id, User.user_id, FaceEmbedding.image_hash, FaceEmbedding.encoding, FaceEnrollment.status
+    ).outerjoin(
+        FaceEmbedding, and_(
+            FaceEmbedding.user_id == User.id,
+            FaceEmbedding.image_url == User.image_url,
+            FaceEmbedding.model_version == FACE_MODEL_VERSION
+        )
+    ).outerjoin(
+        FaceEnrollment, and_(FaceEnrollment.user_id == User.id, FaceEnrollment.image_url == User.image_url)
+    ).filter(
+        User.image_url.isnot(None),
+        User.organization_id == organization_id
+    )
+    if user_ids is not None:
+        query = query.filter(User.id.in_(user_ids))
+    return query.all()
+
+
+def _current_versions(organization_id, user_ids=None):
+    # Same join without the vectors: {User.id: (user_id, image_hash)}, image_hash is None until enrolled
+    query = db.session.query(User.id, User.user_id, FaceEmbedding.image_hash).outerjoin(
+        FaceEmbedding, and_(
+            FaceEmbedding.user_id == User.id,
+            FaceEmbedding.image_url == User.image_url,
+            FaceEmbedding.model_version == FACE_MODEL_VERSION
+        )
+    ).filter(
+        User.image_url.isnot(None),
+        User.organization_id == organization_id
+    )
+    if user_ids is not None:
+        query = query.filter(User.id.in_(user_ids))
+    return {id: (user_id, image_hash) for id, user_id, image_hash in query.distinct()}
+
+
+def _load_encodings(organization_id, user_ids=None):
+    # Stored encodings for the organization (or just user_ids); missing ones are queued for enrollment
+    encodings, names, owners, versions = [], [], [], {}
+    missing_ids = []
+    for id, user_id, image_hash, encoding, enrollment_status in _stored_embeddings(organization_id, user_ids):
+        if encoding is None:
+            versions[id] = (user_id, None)
+            # Images without a usable face are not retried until they change
+            if enrollment_status not in ("no_face", "failed"):
+                missing_ids.append(id)
+            continue
+        encodings.append(np.frombuffer(encoding, dtype=np.float64))
+        names.append(user_id)
+        owners.append(id)
+        versions[id] = (user_id, image_hash)
+
+    # Users that were never enrolled (or whose image changed) are encoded in the background and
+    # swapped in as a delta once they're done, so loading never waits on downloads
+    stats = {"stored": len(encodings), "enrollment": None}
+    if missing_ids:
+        users = User.query.options(joinedload(User.face_enrollment)).filter(User.id.in_(missing_ids)).all()
+        schedule_enrollment(users)
+        db.session.commit()
+        stats["enrollment"] = {"queued": len(users)}
+
+    return encodings, names, owners, versions, stats
+
+
+def _apply_delta(known_faces, organization_id, user_ids=None):
+    # Compare per-user versions with the database and re-read only the users that changed
+    current = _current_versions(organization_id, user_ids)
+    checked = set(user_ids) if user_ids is not None else set(known_faces.versions) | set(current)
+    changed = {id for id in checked if known_faces.versions.get(id) != current.get(id)}
+    if not changed:
+        known_faces.built_at = time.monotonic()
+        return known_faces, {"changed": 0, "enrollment": None}
+
+    encodings, names, owners, versions, stats = _load_encodings(organization_id, changed & set(current))
+    stats["changed"] = len(changed)
+    return known_faces.updated(changed, encodings, names, owners, versions), stats
+
+
+def load_known_faces(organization_id, force_reload=False, with_stats=False):
+    # A full rebuild is only needed on first load or when forced (e.g. after a model change)
+    cached = None if force_reload else known_faces_cache.get(organization_id)
+    if cached is not None:
+        dirty = known_faces_cache.take_dirty(organization_id)
+        if time.monotonic() - cached.built_at > FACE_CACHE_REVALIDATE_SECONDS:
+            # Other worker processes don't share our invalidation events, so periodically diff everything
+            dirty = None
+        elif not dirty:
+            return (cached, {"cached": True}) if with_stats else cached
+
+        generation = known_faces_cache.generation(organization_id)
+        known_faces, stats = _apply_delta(cached, organization_id, dirty)
+        stats["cached"] = True
+        if stats["changed"]:
+            face_store.save_later(organization_id, known_faces)
+        known_faces_cache.put(organization_id, known_faces, generation)
+        return (known_faces, stats) if with_stats else known_faces
+
+    generation = known_faces_cache.generation(organization_id)
+    known_faces_cache.take_dirty(organization_id)
+
+    # Another worker (or this one before a restart) may already have written the organization to disk;
+    # then only users whose versions differ from the database are re-read
+    stored = None if force_reload else face_store.load(
+        organization_id, FACE_INDEX_KIND, FACE_ANN_THRESHOLD, FACE_ENCODING_DTYPE
+    )
+    if stored is not None:
+        known_faces, stats = _apply_delta(stored, organization_id)
+        stats["cached"] = False
+        stats["stored"] = len(stored)
+        if stats["changed"]:
+            face_store.save_later(organization_id, known_faces)
+        known_faces_cache.put(organization_id, known_faces, generation)
+        return (known_faces, stats) if with_stats else known_faces
+
+    encodings, names, owners, versions, stats = _load_encodings(organization_id)
+    stats["cached"] = False
+
+    # Cache the results per organization as one contiguous matrix
+    known_faces = KnownFaces(encodings, names, owners, versions, FACE_INDEX_KIND, FACE_ANN_THRESHOLD,
+                             encoding_dtype=FACE_ENCODING_DTYPE)
+    face_store.save_later(organization_id, known_faces)
+    known_faces_cache.put(organization_id, known_faces, generation)
+    return (known_faces, stats) if with_stats else known_faces
+
+
+# Cache maintenance: user writes that change who can be recognized mark those users dirty in their
+# organization's entry once the transaction commits
+def _mark_stale(session, organization_id, user_id):
+    if organization_id is not None:
+        stale = session.info.setdefault("stale_face_users", {})
+        stale.setdefault(organization_id, set()).add(user_id)
+
+
+@event.listens_for(User, "after_insert")
+@event.listens_for(User, "after_delete")
+def _user_membership_changed(mapper, connection, target):
+    if target.image_url:
+        _mark_stale(inspect(target).session, target.organization_id, target.id)
+
+
+@event.listens_for(User, "after_update")
+def _user_updated(mapper, connection, target):
+    state = inspect(target)
+    session = state.session
+    for attr in ("image_url", "user_id", "organization_id"):
+        history = state.attrs[attr].history
+        if history.has_changes():
+            _mark_stale(session, target.organization_id, target.id)
+            # Moving to another organization also changes the old one
+            if attr == "organization_id":
+                for organization_id in history.deleted:
+                    _mark_stale(session, organization_id, target.id)
+
+
+@event.listens_for(Session, "after_commit")
+def _mark_dirty_faces(session):
+    for organization_id, user_ids in session.info.pop("stale_face_users", {}).items():
+        known_faces_cache.mark_dirty(organization_id, user_ids)
+
+
+@event.listens_for(Session, "after_commit")
+def _enqueue_enrollments(session):
+    # Identity keys survive the commit's expiry, so this doesn't touch the database
+    users = session.info.pop("enroll_face_users", [])
+    user_ids = {inspect(user).identity[0] for user in users if inspect(user).identity}
+    if user_ids:
+        enrollment_queue.put(current_app._get_current_object(), user_ids)
+
+
+@event.listens_for(Organization, "after_delete")
+def _organization_deleted(mapper, connection, target):
+    inspect(target).session.info.setdefault("deleted_face_organizations", set()).add(target.id)
+
+
+@event.listens_for(Session, "after_commit")
+def _delete_stored_faces(session):
+    for organization_id in session.info.pop("deleted_face_organizations", ()):
+        face_store.delete(organization_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_dirty_faces(session):
+    session.info.pop("stale_face_users", None)
+    session.info.pop("enroll_face_users", None)
+    session.info.pop("deleted_face_organizations", None)
+
+
+def backfill_face_embeddings(organization_id=None, force=False, batch_size=500):
+    # Encode every user with an image that has no current embedding (or all of them when forced)
+    query = User.query.filter(User.image_url.isnot(None))
+    if organization_id is not None:
+        query = query.filter(User.organization_id == organization_id)
+
+    if not force:
+        current = db.session.query(FaceEmbedding.user_id).filter(
+            FaceEmbedding.user_id == User.id,
+            FaceEmbedding.image_url == User.image_url,
+            FaceEmbedding.model_version == FACE_MODEL_VERSION
+        ).exists()
+        query = query.filter(~current)
 
-        except requests.exceptions.RequestException as req_err:
-            print(f"[Error] Skipping {user_id}: Image request failed ({req_err})")
-        except Exception as e:
-            print(f"[Error] Unexpected issue processing {user_id}: {e}")
+    users = query.order_by(User.id).all()
+    totals = {"users": 0, "enrolled": 0, "no_face": 0, "failed": 0, "seconds": 0.0}
+    for offset in range(0, len(users), batch_size):
+        batch = users[offset:offset + batch_size]
+        _, stats = enroll_users(batch)
+        totals["users"] += stats["users"]
+        totals["enrolled"] += stats["encode"]["ok"]
+        totals["no_face"] += stats["encode"]["no_face"]
+        totals["failed"] += (stats["download"]["failed"] + stats["encode"]["bad_image"]
+                             + stats["encode"]["failed"])
+        totals["seconds"] += stats["total_seconds"]
 
-    # Cache the results per organization
-    known_faces_cache[organization_id] = (known_face_encodings, known_face_names)
-    return known_faces_cache[organization_id]
+    return totals
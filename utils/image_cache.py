@@ -0,0 +1,199 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+class ImageCache:
+    """Content-addressed disk cache of downloaded images.
+
+    Image bytes are stored once per SHA-256 under blobs/, and each URL has a small JSON entry under
+    urls/ with the hash of its last response and the ETag / Last-Modified it came with. Cached
+    URLs are revalidated with a conditional GET, so an unchanged image costs a 304 and a disk
+    read. Blobs are evicted least recently used first once max_bytes is exceeded.
+    """
+
+    # Eviction frees space down to this share of max_bytes, so blobs/ is scanned once per that
+    # much new data instead of on every miss
+    LOW_WATERMARK = 0.9
+    # Other processes share the directory; the running total picks up their writes this often
+    RESCAN_SECONDS = 300
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._bytes = None  # Size of blobs/, scanned on first use
+        self._added = 0  # Bytes written by this process, so writes during a scan aren't lost
+        self._scanned_at = None
+        self._scanning = False
+        self.hits = 0
+        self.misses = 0
+        self.bytes_downloaded = 0
+        self.bytes_saved = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self):
+        return bool(self.directory)
+
+    def fetch(self, session, url, timeout=10):
+        # Bytes of the image at url, from disk when the server confirms it hasn't changed
+        if not self.enabled:
+            response = session.get(url, timeout=timeout)
+            response.raise_for_status()
+            return response.content
+
+        entry = self._read_entry(url)
+        headers = {}
+        if entry is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        response = session.get(url, headers=headers, timeout=timeout)
+        if response.status_code == 304 and entry is not None:
+            data = self._read_blob(entry["hash"])
+            if data is not None:
+                with self._lock:
+                    self.hits += 1
+                    self.bytes_saved += len(data)
+                return data
+            # Evicted between the check and the read; fetch it unconditionally
+            response = session.get(url, timeout=timeout)
+        response.raise_for_status()
+
+        data = response.content
+        content_hash = hashlib.sha256(data).hexdigest()
+        self._write_blob(content_hash, data)
+        self._write_entry(url, {
+            "url": url,
+            "hash": content_hash,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "size": len(data),
+        })
+        with self._lock:
+            self.misses += 1
+            self.bytes_downloaded += len(data)
+        self._evict()
+        return data
+
+    def _entry_path(self, url):
+        return os.path.join(self.directory, "urls", hashlib.sha256(url.encode()).hexdigest() + ".json")
+
+    def _blob_path(self, content_hash):
+        return os.path.join(self.directory, "blobs", content_hash[:2], content_hash)
+
+    def _read_entry(self, url):
+        try:
+            with open(self._entry_path(url)) as entry_file:
+                entry = json.load(entry_file)
+        except (OSError, ValueError):
+            return None
+        # Without its blob the entry can't answer a 304
+        return entry if os.path.exists(self._blob_path(entry.get("hash", ""))) else None
+
+    def _write_entry(self, url, entry):
+        self._write_atomic(self._entry_path(url), json.dumps(entry).encode())
+
+    def _read_blob(self, content_hash):
+        path = self._blob_path(content_hash)
+        try:
+            with open(path, "rb") as blob_file:
+                data = blob_file.read()
+            # The modification time is the LRU clock
+            os.utime(path)
+        except OSError:
+            return None
+        return data
+
+    def _write_blob(self, content_hash, data):
+        path = self._blob_path(content_hash)
+        if os.path.exists(path):
+            os.utime(path)
+            return
+        self._write_atomic(path, data)
+        with self._lock:
+            self._added += len(data)
+            if self._bytes is not None:
+                self._bytes += len(data)
+
+    def _write_atomic(self, path, data):
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as tmp_file:
+                tmp_file.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+    def _blobs(self):
+        # (mtime, size, path) of every cached blob
+        blobs = []
+        for root, _, names in os.walk(os.path.join(self.directory, "blobs")):
+            for name in names:
+                if name.startswith(".tmp-"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                blobs.append((stat.st_mtime, stat.st_size, path))
+        return blobs
+
+    def _evict(self):
+        # The scan runs outside the lock; a miss that finds one in progress leaves it to finish
+        with self._lock:
+            due = self._scanned_at is None or time.monotonic() - self._scanned_at >= self.RESCAN_SECONDS
+            if self._scanning or (not due and self._bytes <= self.max_bytes):
+                return
+            self._scanning = True
+            added = self._added
+
+        try:
+            blobs = sorted(self._blobs())
+            total = sum(size for _, size, _ in blobs)
+            target = self.max_bytes * self.LOW_WATERMARK if total > self.max_bytes else total
+            evicted = 0
+            for _, size, path in blobs:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                evicted += 1
+            with self._lock:
+                self._bytes = total + self._added - added
+                self._scanned_at = time.monotonic()
+                self.evictions += evicted
+        finally:
+            with self._lock:
+                self._scanning = False
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                "directory": self.directory,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / requests, 4) if requests else 0.0,
+                "bytes_downloaded": self.bytes_downloaded,
+                "bytes_saved": self.bytes_saved,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,173 @@
+import time
+import cv2
+from dataclasses import dataclass, asdict
+
+from config import MJPEG_MAX_WIDTH, MJPEG_QUALITY, MJPEG_MAX_FPS
+
+MIN_QUALITY = 30
+MIN_FPS = 2.0
+# A write slower than this share of the frame interval means the client (or its link) is behind
+SLOW_WRITE_RATIO = 0.5
+FAST_WRITE_RATIO = 0.1
+# Consecutive fast writes before quality/rate is raised again
+RECOVERY_FRAMES = 30
+
+
+@dataclass
+class StreamSettings:
+    max_width: int = MJPEG_MAX_WIDTH  # Frames wider than this are downscaled (0 = as captured)
+    quality: int = MJPEG_QUALITY  # JPEG quality 1-100
+    max_fps: float = MJPEG_MAX_FPS  # Upper bound on frames sent per second
+    adaptive: bool = True  # Lower quality, then rate, while socket writes are slow
+
+    @classmethod
+    def from_args(cls, args):
+        # Build settings from query parameters (?width=640&quality=70&max_fps=10&adaptive=0)
+        defaults = cls()
+        return cls(
+            max_width=max(0, int(args.get("width", defaults.max_width))),
+            quality=max(MIN_QUALITY, min(int(args.get("quality", defaults.quality)), 100)),
+            max_fps=max(MIN_FPS, min(float(args.get("max_fps", defaults.max_fps)), 60.0)),
+            adaptive=str(args.get("adaptive", defaults.adaptive)).lower() not in ("0", "false", "no"),
+        )
+
+    def to_dict(self):
+        return asdict(self)
+
+
+def encode_jpeg(frame, max_width, quality):
+    height, width = frame.shape[:2]
+    if max_width and width > max_width:
+        scale = max_width / width
+        frame = cv2.resize(frame, (max_width, int(height * scale)), interpolation=cv2.INTER_AREA)
+    ret, jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return jpeg.tobytes() if ret else None
+
+
+class MjpegEncoder:
+    """Paces one viewer, adapting the JPEG quality and frame rate it asks for to how fast it reads."""
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.quality = settings.quality
+        self.fps = settings.max_fps
+        self.sent = 0
+        self.skipped = 0  # Frames replaced by a newer one before they were due
+        self.bytes_sent = 0
+        self.last_write_ms = 0.0
+        self._fast_writes = 0
+        self._next_send_at = 0.0
+
+    @property
+    def frame_interval(self):
+        return 1.0 / self.fps
+
+    def wait(self):
+        # Sleep until the next frame is due at the current rate
+        remaining = self._next_send_at - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+
+    @property
+    def variant(self):
+        # The (max_width, quality) this viewer's frames are currently encoded at
+        return self.settings.max_width, self.quality
+
+    def record_write(self, started, size):
+        # Called after the client consumed a frame; the time since `started` is the socket write
+        now = time.monotonic()
+        elapsed = now - started
+        self.sent += 1
+        self.bytes_sent += size
+        self.last_write_ms = elapsed * 1e3
+        self._next_send_at = started + self.frame_interval
+        if self.settings.adaptive:
+            self._adapt(elapsed)
+
+    def _adapt(self, elapsed):
+        if elapsed > self.frame_interval * SLOW_WRITE_RATIO:
+            self._fast_writes = 0
+            # Smaller frames first; only drop the rate once quality is at its floor
+            if self.quality > MIN_QUALITY:
+                self.quality = max(MIN_QUALITY, self.quality - 10)
+            else:
+                self.fps = max(MIN_FPS, self.fps * 0.75)
+        elif elapsed < self.frame_interval * FAST_WRITE_RATIO:
+            self._fast_writes += 1
+            if self._fast_writes >= RECOVERY_FRAMES:
+                self._fast_writes = 0
+                if self.fps < self.settings.max_fps:
+                    self.fps = min(self.settings.max_fps, self.fps / 0.75)
+                elif self.quality < self.settings.quality:
+                    self.quality = min(self.settings.quality, self.quality + 10)
+
+    def stats(self):
+        return {
+            "settings": self.settings.to_dict(),
+            "quality": self.quality,
+            "fps": round(self.fps, 2),
+            "sent": self.sent,
+            "skipped": self.skipped,
+            "bytes_sent": self.bytes_sent,
+            "last_write_ms": round(self.last_write_ms, 2),
+        }
+
+
+class JpegVariants:
+    """Encodes a frame once per distinct (max_width, quality) whose viewers are due for one.
+
+    demand maps each variant to the highest frame rate among the viewers that use it; a frame
+    nobody is due for isn't encoded at all. Runs where the frames are, in the recognition worker
+    process or thread, so only JPEG bytes reach the viewers.
+    """
+
+    def __init__(self):
+        self.demand = {}
+        self.encoded = 0
+        self.bytes_encoded = 0
+        self.encode_seconds = 0.0
+        self._sent_at = {}
+
+    def set_demand(self, demand):
+        self.demand = demand
+        self._sent_at = {variant: sent_at for variant, sent_at in self._sent_at.items() if variant in demand}
+
+    def encode(self, frame):
+        # {variant: JPEG bytes} for the variants that are due, empty if none is
+        now = time.monotonic()
+        jpegs = {}
+        for variant, fps in self.demand.items():
+            # Up to a fifth of an interval early, so capture jitter doesn't halve the rate
+            if now - self._sent_at.get(variant, 0.0) < 0.8 / fps:
+                continue
+            started = time.monotonic()
+            jpeg = encode_jpeg(frame, *variant)
+            self.encode_seconds += time.monotonic() - started
+            if jpeg is not None:
+                jpegs[variant] = jpeg
+                self._sent_at[variant] = now
+                self.encoded += 1
+                self.bytes_encoded += len(jpeg)
+        return jpegs
+
+    def stats(self):
+        return {
+            "variants": len(self.demand),
+            "encoded": self.encoded,
+            "bytes_encoded": self.bytes_encoded,
+            "avg_encode_ms": round(self.encode_seconds / self.encoded * 1000, 2) if self.encoded else 0.0,
+        }
+
+
+def generate_mjpeg(subscriber, encoder):
+    """Yield multipart JPEG parts for one viewer, sending only the newest frame once one is due."""
+    while True:
+        encoder.wait()
+        jpeg, skipped = subscriber.latest_frame()
+        encoder.skipped += skipped
+        if jpeg is None:
+            return
+        started = time.monotonic()
+        yield (b'--frame\r\n'
+               b'Content-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n\r\n')
+        encoder.record_write(started, len(jpeg))
@@ -0,0 +1,149 @@
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class PasswordHashingBusy(Exception):
+    """Raised when no hashing slot frees up within the wait timeout."""
+
+
+def _hash_job(password, method):
+    start = time.perf_counter()
+    password_hash = generate_password_hash(password, method=method) if method else generate_password_hash(password)
+    return password_hash, time.perf_counter() - start
+
+
+def _verify_job(password_hash, password):
+    start = time.perf_counter()
+    return check_password_hash(password_hash, password), time.perf_counter() - start
+
+
+def hash_parameters(password_hash):
+    # The "method:params" prefix werkzeug stores in front of the salt, e.g. "pbkdf2:sha256:600000"
+    return password_hash.split("$", 1)[0]
+
+
+class PasswordHasher:
+    """Runs werkzeug password hashing on a small process pool instead of the request thread.
+
+    At most max_pending hashes are submitted at a time; further callers wait up to wait_timeout
+    seconds for a slot and then get PasswordHashingBusy. Queue time is measured from the call to
+    the moment a pool process starts hashing. method is passed to generate_password_hash (None for
+    werkzeug's default); hashes stored with other parameters are reported by needs_rehash().
+    """
+
+    def __init__(self, workers, max_pending, wait_timeout, method=None):
+        self.workers = workers
+        self.wait_timeout = wait_timeout
+        self.method = method or None
+        self._parameters = None
+        self._resolving = False
+        self.max_pending = max_pending
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pool = None
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.hashes = 0
+        self.verifications = 0
+        self.rejected = 0
+        self.queue_seconds = 0.0
+        self.max_queue_seconds = 0.0
+        self.hash_seconds = 0.0
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None and self.workers > 0:
+                # Spawned rather than forked from a web process that may be running other threads
+                self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+            return self._pool
+
+    def _run(self, function, *args):
+        start = time.perf_counter()
+        if not self._slots.acquire(timeout=self.wait_timeout):
+            with self._lock:
+                self.rejected += 1
+            raise PasswordHashingBusy("Too many password hashes are in progress, try again shortly.")
+        try:
+            with self._lock:
+                self.pending += 1
+            pool = self._get_pool()
+            if pool is None:
+                result, seconds = function(*args)
+            else:
+                result, seconds = pool.submit(function, *args).result()
+        finally:
+            with self._lock:
+                self.pending -= 1
+            self._slots.release()
+
+        # Whatever the call took beyond the hash itself was spent waiting for a slot or a pool process
+        queued = max(time.perf_counter() - start - seconds, 0.0)
+        with self._lock:
+            self.queue_seconds += queued
+            self.max_queue_seconds = max(self.max_queue_seconds, queued)
+            self.hash_seconds += seconds
+        return result
+
+    @property
+    def parameters(self):
+        # Parameters of new hashes as werkzeug writes them, so "pbkdf2" compares equal to
+        # "pbkdf2:sha256:<default iterations>"; taken from the first hash made (None until then)
+        return self._parameters
+
+    def _resolve_parameters(self):
+        # One throwaway hash on a background thread, so no login waits for it
+        with self._lock:
+            if self._resolving:
+                return
+            self._resolving = True
+
+        def resolve():
+            try:
+                self.hash("")
+            except PasswordHashingBusy:
+                pass
+            finally:
+                with self._lock:
+                    self._resolving = False
+
+        threading.Thread(target=resolve, name="password-parameters", daemon=True).start()
+
+    def hash(self, password):
+        result = self._run(_hash_job, password, self.method)
+        with self._lock:
+            self.hashes += 1
+            if self._parameters is None:
+                self._parameters = hash_parameters(result)
+        return result
+
+    def verify(self, password_hash, password):
+        result = self._run(_verify_job, password_hash, password)
+        with self._lock:
+            self.verifications += 1
+        return result
+
+    def needs_rehash(self, password_hash):
+        # False while the parameters are unknown: the upgrade happens on a later login instead
+        if self._parameters is None:
+            self._resolve_parameters()
+            return False
+        return hash_parameters(password_hash) != self._parameters
+
+    def stats(self):
+        with self._lock:
+            operations = self.hashes + self.verifications
+            return {
+                "workers": self.workers,
+                "parameters": self._parameters,
+                "max_pending": self.max_pending,
+                "pending": self.pending,
+                "hashes": self.hashes,
+                "verifications": self.verifications,
+                "rejected": self.rejected,
+                "avg_queue_ms": round(self.queue_seconds / operations * 1000, 2) if operations else 0.0,
+                "max_queue_ms": round(self.max_queue_seconds * 1000, 2),
+                "avg_hash_ms": round(self.hash_seconds / operations * 1000, 2) if operations else 0.0,
+            }
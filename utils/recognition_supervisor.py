@@ -0,0 +1,204 @@
+import hashlib
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+from config import RECOGNITION_LOCK_DIR, RECOGNITION_PROCESS_ENCODE_WORKERS, RECOGNITION_STAGE_BUFFER
+
+try:
+    import fcntl
+except ImportError:  # Windows: sources are only coordinated within one web process
+    fcntl = None
+
+# Spawned rather than forked: the web process has threads and dlib state that must not be copied
+_context = multiprocessing.get_context("spawn")
+
+# How often a worker process attaches pipeline stats to the frames it sends
+STATS_INTERVAL_SECONDS = 1.0
+
+# How long a stopping worker process gets to exit before it is terminated
+STOP_TIMEOUT_SECONDS = 10
+
+
+class SourceBusyError(Exception):
+    pass
+
+
+class SourceLock:
+    """Host-wide claim on a video source: an flock on a file named after the source's key.
+
+    Web worker processes don't share memory, so this is what keeps two of them from capturing the
+    same camera. The file holds the session that owns the source; the kernel releases the lock if
+    the owning process dies.
+    """
+
+    def __init__(self, source, directory=RECOGNITION_LOCK_DIR):
+        self.source = source
+        self.path = os.path.join(directory, hashlib.sha1(source.key.encode()).hexdigest() + ".lock")
+        self._file = None
+
+    def acquire(self, session_id):
+        if fcntl is None or not RECOGNITION_LOCK_DIR:
+            return self
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        lock_file = open(self.path, "a+")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.seek(0)
+            owner = lock_file.read().strip() or "?"
+            lock_file.close()
+            raise SourceBusyError(f"{self.source.spec} is in use by session {owner}.")
+        lock_file.seek(0)
+        lock_file.truncate()
+        lock_file.write(str(session_id))
+        lock_file.flush()
+        self._file = lock_file
+        return self
+
+    def release(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class WorkerProcess:
+    """Handle on one recognition worker process, the queue its JPEGs arrive on and the queue that
+    tells it which sizes and qualities its viewers want."""
+
+    def __init__(self, source, session_id, organization_id, settings):
+        self.source = source
+        self.session_id = session_id
+        self.organization_id = organization_id
+        self.output = _context.Queue(maxsize=RECOGNITION_STAGE_BUFFER)
+        self.control = _context.Queue()
+        self.stop_event = _context.Event()
+        self.process = _context.Process(
+            target=run_worker_process,
+            args=(session_id, organization_id, settings, source.spec, self.output, self.control, self.stop_event,
+                  RECOGNITION_PROCESS_ENCODE_WORKERS),
+            name=f"recognition-{session_id}",
+            daemon=True,
+        )
+
+    @property
+    def pid(self):
+        return self.process.pid
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+    def to_dict(self):
+        return {
+            "session_id": self.session_id,
+            "organization_id": self.organization_id,
+            "source": self.source.to_dict(),
+            "pid": self.pid,
+            "alive": self.is_alive(),
+        }
+
+
+class RecognitionSupervisor:
+    """Starts one worker process per video source and cleans them up when their stream ends.
+
+    There is one supervisor per web process; SourceLock is what makes a source exclusive across them.
+    """
+
+    def __init__(self):
+        self._processes = {}
+        self._lock = threading.Lock()
+
+    def start(self, source, session_id, organization_id, settings):
+        with self._lock:
+            running = self._processes.get(source.key)
+            if running is not None and running.is_alive() and running.stop_event.is_set():
+                # Still shutting down (e.g. the session's last viewer just left): let it finish
+                running.process.join(timeout=STOP_TIMEOUT_SECONDS)
+            if running is not None and running.is_alive():
+                raise SourceBusyError(f"{source.spec} is in use by session {running.session_id}.")
+            worker = WorkerProcess(source, session_id, organization_id, settings)
+            worker.process.start()
+            self._processes[source.key] = worker
+            return worker
+
+    def release(self, worker, timeout=STOP_TIMEOUT_SECONDS):
+        worker.stop_event.set()
+        # Drain frames so the child isn't blocked on a full queue while shutting down
+        deadline = time.monotonic() + timeout
+        while worker.is_alive() and time.monotonic() < deadline:
+            try:
+                worker.output.get(timeout=0.2)
+            except queue.Empty:
+                pass
+        if worker.is_alive():
+            worker.process.terminate()
+        worker.process.join(timeout=1)
+        # Demand the child never read must not hold up this process' exit
+        worker.control.cancel_join_thread()
+        with self._lock:
+            if self._processes.get(worker.source.key) is worker:
+                del self._processes[worker.source.key]
+
+    def status(self):
+        with self._lock:
+            return [worker.to_dict() for worker in self._processes.values()]
+
+
+supervisor = RecognitionSupervisor()
+
+
+def run_worker_process(session_id, organization_id, settings, source_spec, output, control, stop_event,
+                       encode_workers):
+    # Entry point of a worker process: run the recognition pipeline and send JPEGs of the annotated
+    # frames to the relay, encoded here for the viewers' current demand (from the control queue)
+    from app import app
+    from utils.face_utils import set_encode_workers
+    from utils.mjpeg_utils import JpegVariants
+    from utils.recognition_worker import RecognitionPipeline
+    from utils.video_sources import VideoSource
+
+    # One process per camera already spreads the load, so keep this process' own encoder pool small
+    set_encode_workers(encode_workers)
+
+    pipeline = None
+    variants = JpegVariants()
+    stats_sent_at = 0.0
+
+    def pipeline_stats():
+        stats = pipeline.stats()
+        stats["jpeg"] = variants.stats()
+        return stats
+
+    def publish(frame):
+        nonlocal stats_sent_at
+        while True:
+            try:
+                variants.set_demand(control.get_nowait())
+            except queue.Empty:
+                break
+        jpegs = variants.encode(frame)
+        stats = None
+        now = time.monotonic()
+        if now - stats_sent_at >= STATS_INTERVAL_SECONDS:
+            stats, stats_sent_at = pipeline_stats(), now
+        if not jpegs and stats is None:
+            # No viewer is due for this frame
+            return
+        try:
+            output.put_nowait(("frame", jpegs, stats))
+        except queue.Full:
+            # The relay is behind; this frame is dropped like any other stale frame
+            pass
+
+    pipeline = RecognitionPipeline(
+        app, session_id, organization_id, settings, VideoSource(source_spec), publish, stop_event
+    )
+    try:
+        pipeline.run()
+    finally:
+        try:
+            output.put(("stopped", None, pipeline_stats()), timeout=5)
+        except queue.Full:
+            pass
@@ -0,0 +1,55 @@
+import cv2
+import face_recognition
+from dataclasses import dataclass, asdict
+
+from config import RECOGNITION_TARGET_FPS, RECOGNITION_SCALE, RECOGNITION_DETECT_INTERVAL
+
+GREEN_COLOR = (39, 123, 62)
+RED_COLOR = (89, 14, 195)
+
+
+@dataclass
+class DetectionSettings:
+    target_fps: float = RECOGNITION_TARGET_FPS  # Upper bound on processed frames per second (0 = unlimited)
+    scale: float = RECOGNITION_SCALE  # Detection runs on a copy resized by this factor
+    detect_interval: int = RECOGNITION_DETECT_INTERVAL  # Detect every N frames, reuse labels in between
+
+    @classmethod
+    def from_args(cls, args):
+        # Build settings from query parameters (?fps=10&scale=0.5&interval=3), clamped to sane ranges
+        defaults = cls()
+        return cls(
+            target_fps=max(0.0, min(float(args.get("fps", defaults.target_fps)), 60.0)),
+            scale=max(0.1, min(float(args.get("scale", defaults.scale)), 1.0)),
+            detect_interval=max(1, min(int(args.get("interval", defaults.detect_interval)), 30)),
+        )
+
+    def to_dict(self):
+        return asdict(self)
+
+
+def detect_faces(rgb_frame, scale=1.0):
+    # HOG detection on a downscaled copy, boxes mapped back to full-resolution coordinates
+    if scale >= 1.0:
+        return face_recognition.face_locations(rgb_frame)
+
+    small_frame = cv2.resize(rgb_frame, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    height, width = rgb_frame.shape[:2]
+    locations = []
+    for top, right, bottom, left in face_recognition.face_locations(small_frame):
+        locations.append((
+            max(0, int(top / scale)),
+            min(width, int(right / scale)),
+            min(height, int(bottom / scale)),
+            max(0, int(left / scale)),
+        ))
+    return locations
+
+
+def draw_label(frame, location, name, color):
+    top, right, bottom, left = location
+    cv2.rectangle(frame, (left, top), (right, bottom), color, 2)
+    label_position = max(top - 10, 0)
+    cv2.rectangle(frame, (left, label_position - 20), (right, label_position), color, cv2.FILLED)
+    font = cv2.FONT_HERSHEY_SIMPLEX
+    cv2.putText(frame, name, (left + 6, label_position - 5), font, 0.5, (255, 255, 255), 1)
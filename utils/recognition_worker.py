@@ -0,0 +1,499 @@
+import queue
+import threading
+import time
+import cv2
+
+from config import (db, RECOGNITION_CLIENT_BUFFER, RECOGNITION_REFRESH_SECONDS, RECOGNITION_STAGE_BUFFER,
+                    RECOGNITION_WORKER_PROCESSES)
+from models import AttendanceRecord, User
+from utils.attendance_utils import AttendanceBuffer
+from utils.face_quality import FaceQualityGate
+from utils.face_tracker import FaceTracker
+from utils.face_utils import encode_faces, load_known_faces, run_in_encode_pool
+from utils.mjpeg_utils import JpegVariants
+from utils.recognition_supervisor import SourceBusyError, SourceLock, supervisor
+from utils.recognition_utils import GREEN_COLOR, RED_COLOR, detect_faces, draw_label
+
+# Running workers per attendance session
+_workers = {}
+_workers_lock = threading.Lock()
+
+# How long a new viewer waits for a stream that is shutting down to let go of its source
+RESTART_TIMEOUT_SECONDS = 15
+
+
+class DroppingQueue:
+    """Bounded queue that discards its oldest item instead of blocking the producer."""
+
+    def __init__(self, max_items):
+        self._queue = queue.Queue(maxsize=max_items)
+        self.dropped = 0
+
+    def put(self, item):
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout=None):
+        return self._queue.get(timeout=timeout)
+
+    def depth(self):
+        return self._queue.qsize()
+
+
+class Subscriber(DroppingQueue):
+    """One viewer of a worker's stream; keeps only the newest few frames if the client falls behind.
+
+    Frames arrive as JPEG bytes at the size and quality its encoder asks for; a subscriber without
+    an encoder (a headless run) receives nothing but the end of the stream.
+    """
+
+    def __init__(self, max_frames=RECOGNITION_CLIENT_BUFFER, encoder=None):
+        super().__init__(max_frames)
+        self.encoder = encoder  # Per-viewer MjpegEncoder, reported in the worker's stats
+
+    def next_frame(self, timeout=None):
+        # Returns None once the worker has stopped
+        return self.get(timeout=timeout)
+
+    def latest_frame(self):
+        # Wait for a frame, then skip to the newest queued one; returns (frame or None, skipped)
+        frame = self.get()
+        skipped = 0
+        while frame is not None:
+            try:
+                newer = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if newer is None:
+                return None, skipped
+            frame = newer
+            skipped += 1
+        return frame, skipped
+
+
+class StageStats:
+    """Processed count and latency (last and exponential moving average) of one pipeline stage."""
+
+    def __init__(self):
+        self.processed = 0
+        self.last_ms = 0.0
+        self.avg_ms = 0.0
+
+    def record(self, seconds):
+        elapsed_ms = seconds * 1e3
+        self.processed += 1
+        self.last_ms = elapsed_ms
+        self.avg_ms = elapsed_ms if self.processed == 1 else 0.9 * self.avg_ms + 0.1 * elapsed_ms
+
+    def to_dict(self):
+        return {"processed": self.processed, "last_ms": round(self.last_ms, 2), "avg_ms": round(self.avg_ms, 2)}
+
+
+class RecognitionPipeline:
+    """Capture, detection and streaming for one video source, publishing annotated frames.
+
+    Work is split into stages connected by bounded queues that drop the oldest frame when a
+    stage falls behind: capture -> stream (draw labels, publish) on every frame, and
+    capture -> detect (detection, encoding, matching) every detect_interval frames. Detection
+    and encoding run on the encoder process pool, so a slow detection only delays labels and
+    a slow viewer never delays capture. publish JPEG-encodes the annotated frame only for the
+    viewers that are due (see JpegVariants). Runs in the web process or in a worker process of
+    utils/recognition_supervisor.py.
+    """
+
+    def __init__(self, app, session_id, organization_id, settings, source, publish, stop_event):
+        self.app = app
+        self.session_id = session_id
+        self.organization_id = organization_id
+        self.settings = settings
+        self.source = source
+        self.publish = publish
+        self.stop_event = stop_event
+        self.attendance = AttendanceBuffer(session_id)
+        self.tracker = FaceTracker()
+        self.quality = FaceQualityGate()
+        self.frames = 0
+        self.labels = []  # (location, name, color) from the latest detection
+        self.detect_queue = DroppingQueue(1)
+        self.stream_queue = DroppingQueue(RECOGNITION_STAGE_BUFFER)
+        self.stages = {"capture": StageStats(), "detect": StageStats(), "stream": StageStats()}
+        self.frame_latency = StageStats()  # Capture to publish
+
+    @property
+    def stopping(self):
+        return self.stop_event.is_set()
+
+    def stats(self):
+        return {
+            "frames": self.frames,
+            "stages": {name: stage.to_dict() for name, stage in self.stages.items()},
+            "frame_latency": self.frame_latency.to_dict(),
+            "queues": {
+                "detect": {"depth": self.detect_queue.depth(), "dropped": self.detect_queue.dropped},
+                "stream": {"depth": self.stream_queue.depth(), "dropped": self.stream_queue.dropped},
+            },
+            "tracking": self.tracker.stats(),
+            "quality": self.quality.stats(),
+            "attendance": self.attendance.stats(),
+        }
+
+    def run(self):
+        stages = [
+            threading.Thread(target=self._stage, args=(self._detect_loop,), daemon=True),
+            threading.Thread(target=self._stage, args=(self._stream_loop,), daemon=True),
+        ]
+        try:
+            for stage in stages:
+                stage.start()
+            self._stage(self._capture_loop)
+        finally:
+            self.stop_event.set()
+            # Unblock the downstream stages and wait for them to finish
+            self.detect_queue.put(None)
+            self.stream_queue.put(None)
+            for stage in stages:
+                stage.join()
+            with self.app.app_context():
+                try:
+                    self.attendance.flush()
+                except Exception as e:
+                    self.app.logger.error(f"Error flushing attendance for session {self.session_id}: {e}")
+                finally:
+                    db.session.remove()
+
+    def _stage(self, loop):
+        # Any stage failing stops the whole pipeline
+        try:
+            loop()
+        except Exception as e:
+            self.app.logger.error(f"Recognition for session {self.session_id} failed in {loop.__name__}: {e}")
+        finally:
+            self.stop_event.set()
+
+    def _capture_loop(self):
+        settings = self.settings
+        frame_interval = 1.0 / settings.target_fps if settings.target_fps > 0 else 0.0
+        video_capture = self.source.open()
+        try:
+            while not self.stopping:
+                started = time.monotonic()
+                ret, frame = video_capture.read()
+                if not ret:
+                    break
+                captured = time.monotonic()
+                self.stages["capture"].record(captured - started)
+
+                if self.frames % settings.detect_interval == 0:
+                    # The stream stage draws on its frame, so detection gets its own copy
+                    self.detect_queue.put((captured, frame.copy()))
+                self.stream_queue.put((captured, frame))
+                self.frames += 1
+
+                # Don't capture frames faster than the target rate
+                remaining = frame_interval - (time.monotonic() - started)
+                if remaining > 0:
+                    time.sleep(remaining)
+        finally:
+            video_capture.release()
+
+    def _stream_loop(self):
+        while True:
+            item = self.stream_queue.get()
+            if item is None:
+                return
+            captured, frame = item
+            started = time.monotonic()
+
+            for location, name, color in self.labels:
+                draw_label(frame, location, name, color)
+
+            # Encoded once per viewer size and quality that is due, if any (utils/mjpeg_utils.py)
+            self.publish(frame)
+
+            now = time.monotonic()
+            self.stages["stream"].record(now - started)
+            self.frame_latency.record(now - captured)
+
+    def _load_faces(self):
+        # Cheap on a warm cache; picks up enrollments made while the stream is running
+        known_faces = load_known_faces(self.organization_id)
+        names = dict(db.session.query(User.user_id, User.name).filter_by(organization_id=self.organization_id).all())
+        return known_faces, names
+
+    def _detect_loop(self):
+        with self.app.app_context():
+            try:
+                self._detect(self.settings)
+            finally:
+                db.session.remove()
+
+    def _detect(self, settings):
+        known_faces, names = self._load_faces()
+        refreshed_at = time.monotonic()
+
+        # Track recorded attendances to avoid multiple inserts
+        existing_attendance = {
+            user_id for user_id, in db.session.query(AttendanceRecord.user_id).filter_by(session_id=self.session_id)
+        }
+
+        while True:
+            item = self.detect_queue.get()
+            if item is None:
+                return
+            _, frame = item
+            started = time.monotonic()
+
+            if started - refreshed_at > RECOGNITION_REFRESH_SECONDS:
+                known_faces, names = self._load_faces()
+                refreshed_at = started
+
+            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            face_locations = run_in_encode_pool(detect_faces, rgb_frame, settings.scale)
+            tracks = self.tracker.update(face_locations)
+
+            # Only faces that aren't already identified by their track need a dlib encoding, and only
+            # if they're large, sharp and frontal enough to match; rejected ones are retried next round
+            unidentified = [track for track in tracks if not track.identified]
+            encodable = set(self.quality.filter(rgb_frame, [track.location for track in unidentified]))
+            pending = [track for track in unidentified if track.location in encodable]
+            if pending:
+                # Encode at full resolution so the downscaled detection doesn't cost accuracy
+                face_encodings = encode_faces(rgb_frame, [track.location for track in pending])
+
+                # Match every new face in the frame with one batched distance computation
+                matches = known_faces.match(face_encodings)
+
+                for (user_id, distance, margin), track in zip(matches, pending):
+                    if user_id is None or user_id not in names:
+                        continue
+                    if user_id not in existing_attendance:
+                        self.attendance.add(user_id)
+                        existing_attendance.add(user_id)  # Mark as recorded
+                    track.user_id = user_id
+                    track.name = names[user_id]
+
+            # Swapped in one assignment so the stream stage never sees a half-built list
+            self.labels = [
+                (track.location, track.name, GREEN_COLOR if track.identified else RED_COLOR)
+                for track in tracks
+            ]
+
+            if self.attendance.due():
+                try:
+                    self.attendance.flush()
+                except Exception as e:
+                    self.app.logger.error(f"Error flushing attendance for session {self.session_id}: {e}")
+
+            self.stages["detect"].record(time.monotonic() - started)
+
+
+class RecognitionWorker(threading.Thread):
+    """Owns the video source of one session and fans its annotated frames out to every viewer.
+
+    The pipeline runs in a dedicated worker process (RECOGNITION_WORKER_PROCESSES) so several
+    cameras use several cores, or directly on this thread otherwise.
+    """
+
+    def __init__(self, app, session_id, organization_id, settings, source, use_process=RECOGNITION_WORKER_PROCESSES,
+                 source_lock=None):
+        super().__init__(name=f"recognition-{session_id}", daemon=True)
+        self.app = app
+        self.session_id = session_id
+        self.organization_id = organization_id
+        self.settings = settings
+        self.source = source
+        self.use_process = use_process
+        self.source_lock = source_lock
+        self.started_at = None
+        self.pipeline = None
+        self.process = None
+        self.pipeline_stats = {}  # Last stats reported by a worker process
+        self.variants = JpegVariants()  # Encodes frames when the pipeline runs on this thread
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    @property
+    def stopping(self):
+        return self._stop_event.is_set()
+
+    def subscribe(self, encoder=None):
+        with self._lock:
+            if self.stopping:
+                return None
+            subscriber = Subscriber(encoder=encoder)
+            self._subscribers.append(subscriber)
+            return subscriber
+
+    def unsubscribe(self, subscriber):
+        # The source is released as soon as the last viewer leaves
+        with self._lock:
+            if subscriber in self._subscribers:
+                self._subscribers.remove(subscriber)
+            if not self._subscribers:
+                self._stop_event.set()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def demand(self):
+        # {(max_width, quality): fps} wanted by the viewers, at the highest rate among those sharing a variant
+        with self._lock:
+            encoders = [subscriber.encoder for subscriber in self._subscribers if subscriber.encoder]
+        demand = {}
+        for encoder in encoders:
+            demand[encoder.variant] = max(demand.get(encoder.variant, 0.0), encoder.fps)
+        return demand
+
+    def broadcast(self, jpegs):
+        # Each viewer gets the JPEG encoded at its own size and quality, if one was due
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            jpeg = jpegs.get(subscriber.encoder.variant) if subscriber.encoder else None
+            if jpeg is not None:
+                subscriber.put(jpeg)
+
+    def _publish(self, frame):
+        # publish callback of a pipeline running on this thread
+        self.variants.set_demand(self.demand())
+        jpegs = self.variants.encode(frame)
+        if jpegs:
+            self.broadcast(jpegs)
+
+    def stats(self):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        stats = {
+            "session_id": self.session_id,
+            "source": self.source.to_dict(),
+            "process": self.process.pid if self.process else None,
+            "settings": self.settings.to_dict(),
+            "uptime_seconds": round(time.monotonic() - self.started_at, 1) if self.started_at else 0.0,
+            "subscribers": len(subscribers),
+        }
+        if self.pipeline:
+            stats.update(self.pipeline.stats(), jpeg=self.variants.stats())
+        else:
+            stats.update(self.pipeline_stats)
+        stats.setdefault("queues", {})["subscribers"] = {
+            "depth": sum(subscriber.depth() for subscriber in subscribers),
+            "dropped": sum(subscriber.dropped for subscriber in subscribers),
+        }
+        stats["viewers"] = [subscriber.encoder.stats() for subscriber in subscribers if subscriber.encoder]
+        return stats
+
+    def run(self):
+        self.started_at = time.monotonic()
+        try:
+            if self.use_process:
+                self._relay_process()
+            else:
+                self.pipeline = RecognitionPipeline(
+                    self.app, self.session_id, self.organization_id, self.settings,
+                    self.source, self._publish, self._stop_event
+                )
+                self.pipeline.run()
+        except Exception as e:
+            self.app.logger.error(f"Recognition worker for session {self.session_id} failed: {e}")
+        finally:
+            self._stop_event.set()
+            _remove_worker(self)
+            if self.source_lock:
+                self.source_lock.release()
+            # Wake up viewers so their responses end
+            with self._lock:
+                subscribers, self._subscribers = self._subscribers, []
+            for subscriber in subscribers:
+                subscriber.put(None)
+            self.app.logger.info(f"Recognition worker for session {self.session_id} stopped: {self.stats()}")
+
+    def _relay_process(self):
+        # Forward JPEGs from the worker process until it exits; ask it to stop once viewers are gone.
+        # The process encodes what the viewers currently ask for, sent over its control queue on change
+        self.process = supervisor.start(self.source, self.session_id, self.organization_id, self.settings)
+        demand = None
+        try:
+            while True:
+                if self.stopping:
+                    self.process.stop_event.set()
+                current = self.demand()
+                if current != demand:
+                    demand = current
+                    self.process.control.put(demand)
+                try:
+                    message = self.process.output.get(timeout=0.5)
+                except queue.Empty:
+                    if not self.process.is_alive():
+                        return
+                    continue
+                kind, payload, stats = message
+                if stats is not None:
+                    self.pipeline_stats = stats
+                if kind == "frame":
+                    self.broadcast(payload)
+                elif kind == "stopped":
+                    return
+        finally:
+            supervisor.release(self.process)
+
+
+def _remove_worker(worker):
+    with _workers_lock:
+        if _workers.get(worker.session_id) is worker:
+            del _workers[worker.session_id]
+
+
+def get_worker(session_id):
+    with _workers_lock:
+        return _workers.get(session_id)
+
+
+def list_workers():
+    with _workers_lock:
+        return list(_workers.values())
+
+
+def subscribe(app, session_id, organization_id, settings, source, encoder=None):
+    """Join the running worker of a session, starting one if needed. Returns (worker, subscriber).
+
+    A worker of this session or source that is still shutting down (its last viewer just left) is
+    waited for, so reconnecting never collides with the session's own old stream. Raises
+    SourceBusyError if another session is capturing from the same source, if any session's stream
+    from it is served by another web process on this host, or if the old worker doesn't finish in time.
+    """
+    deadline = time.monotonic() + RESTART_TIMEOUT_SECONDS
+    while True:
+        with _workers_lock:
+            worker = _workers.get(session_id)
+            subscriber = worker.subscribe(encoder) if worker else None
+            if subscriber is not None:
+                return worker, subscriber
+            stopping = []
+            for other in _workers.values():
+                if other.session_id != session_id and other.source.key != source.key:
+                    continue
+                if not other.stopping:
+                    raise SourceBusyError(f"{source.spec} is in use by session {other.session_id}.")
+                stopping.append(other)
+            if not stopping:
+                source_lock = SourceLock(source).acquire(session_id)
+                worker = RecognitionWorker(app, session_id, organization_id, settings, source, source_lock=source_lock)
+                subscriber = worker.subscribe(encoder)
+                _workers[session_id] = worker
+                worker.start()
+                return worker, subscriber
+
+        # Outside the lock: a stopping worker removes itself from _workers as it finishes
+        for other in stopping:
+            other.join(timeout=max(deadline - time.monotonic(), 0))
+        if time.monotonic() >= deadline and any(other.is_alive() for other in stopping):
+            raise SourceBusyError(f"{source.spec} is still being released, try again shortly.")
@@ -0,0 +1,81 @@
+import os
+import time
+import cv2
+
+STREAM_SCHEMES = ("rtsp://", "rtsps://", "http://", "https://")
+
+
+class VideoSource:
+    """A camera to recognize from: a local device index, a video file or an RTSP/HTTP(MJPEG) URL.
+
+    Specs are stored as strings on Organization.video_source / AttendanceSession.video_source:
+    "0" or "device:1" for local devices, "file:/path/clip.mp4" or a plain path for recordings,
+    and rtsp://... or http(s)://... for network cameras.
+    """
+
+    def __init__(self, spec):
+        spec = str(spec).strip()
+        if not spec:
+            raise ValueError("Video source must not be empty.")
+        self.spec = spec
+        if spec.isdigit() or spec.startswith("device:"):
+            self.kind = "device"
+            index = spec.split(":", 1)[-1]
+            if not index.isdigit():
+                raise ValueError(f"Device index must be a number: {spec}")
+            self.target = int(index)
+        elif spec.lower().startswith(STREAM_SCHEMES):
+            self.kind = "stream"
+            self.target = spec
+        else:
+            self.kind = "file"
+            self.target = spec[len("file:"):] if spec.startswith("file:") else spec
+
+    @property
+    def key(self):
+        # Identifies the physical source; only one worker may capture from it at a time
+        return f"{self.kind}:{self.target}"
+
+    def validate(self):
+        if self.kind == "file" and not os.path.isfile(self.target):
+            raise ValueError(f"Video file not found: {self.target}")
+        return self
+
+    def open(self):
+        capture = cv2.VideoCapture(self.target)
+        if self.kind == "stream":
+            # Keep network cameras from queueing stale frames inside OpenCV
+            capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        if not capture.isOpened():
+            capture.release()
+            raise IOError(f"Could not open video source {self.spec}")
+        return FileCapture(capture) if self.kind == "file" else capture
+
+    def to_dict(self):
+        return {"spec": self.spec, "kind": self.kind}
+
+
+class FileCapture:
+    """Plays a recording back at its own frame rate so it behaves like a live camera."""
+
+    def __init__(self, capture):
+        self.capture = capture
+        fps = capture.get(cv2.CAP_PROP_FPS)
+        self.frame_interval = 1.0 / fps if fps and fps > 0 else 0.0
+        self._next_frame_at = None
+
+    def read(self):
+        now = time.monotonic()
+        if self._next_frame_at is not None and now < self._next_frame_at:
+            time.sleep(self._next_frame_at - now)
+        self._next_frame_at = max(now, self._next_frame_at or now) + self.frame_interval
+        return self.capture.read()
+
+    def release(self):
+        self.capture.release()
+
+
+def resolve_video_source(session, default_spec):
+    # A session's own camera wins over its organization's, then the configured default
+    spec = session.video_source or session.organization.video_source or default_spec
+    return VideoSource(spec)